@@ -1,246 +1,230 @@
+import copy
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Dict, Iterable
+
+import numpy as np
 import pandas as pd
-import dataframe_image as dfi
 from matplotlib.colors import LinearSegmentedColormap
-from source_engine.opus_source import OpusSource
+
+from data_provider import market_data
+from render import collect, export
+from workbook import read_sheet
 
 mandate = {
     'D&R Aktien': '17154631',
     'D&R Aktien Nachhaltigkeit': '79939969'
 }
 
-query = """
-    SELECT
-        accountsegments.name,
-        accountsegments.account_id,
-        accountsegments.nav,
-        reportings.report_date, 
-        positions.name as position_name,
-        positions.asset_class,
-        positions.value_base_ccy as value,
-        positions.bloomberg_query,
-        positions.underlying_name,
-        positions.total_exposure,
-        positions.last_xrate_quantity,
-        positions.country_of_domicile as country,
-        positions.gics_industry_sector as Sector
-    FROM
-        reportings
-            JOIN
-        accountsegments ON (accountsegments.reporting_uuid = reportings.uuid)
-            JOIN
-        positions ON (reportings.uuid = positions.reporting_uuid)
-    WHERE
-            positions.account_segment_id = accountsegments.accountsegment_id
-            AND reportings.newest = 1
-            AND reportings.report = 'positions'
-            AND positions.asset_class in ('STOCK', 'FUTURE')
-            AND positions.dr_class_level_1 = 'EQUITY'
-            AND accountsegments.accountsegment_id in ('{mandate}')
-            AND reportings.report_date = (SELECT
-                                            MAX(report_date)
-                                          FROM
-                                            reportings)
-    """
-hedge_query = """
-        SELECT
-             accountsegments.currency as "base_currency",
-             positions.name,
-             positions.isin,
-             positions.asset_class,
-             positions.bloomberg_query,
-             positions.currency as Currency,
-             positions.eff_volume as volume,
-             positions.position_type,
-             positions.forex_trade_currency,
-             positions.average_entry_quote,
-             positions.last_quote as last_quote,
-             positions.total_exposure as total_exposure,
-             positions.last_xrate_quantity,
-             positions.value_base_ccy as value,
-             positions.percent_nav,
-             positions.profit_and_loss_percent,
-             positions.country_of_domicile as country,
-             positions.gics_industry_sector as sector,
-             positions.dr_class_level_1
-        FROM
-            reportings
-                JOIN
-            accountsegments ON (accountsegments.reporting_uuid = reportings.uuid)
-                JOIN
-            positions ON (reportings.uuid = positions.reporting_uuid)
-        WHERE
-            accountsegments.accountsegment_id in ('{mandate}')
-                AND positions.account_segment_id = accountsegments.accountsegment_id
-                AND reportings.newest = 1
-                AND reportings.report_date = (SELECT
-                    MAX(report_date)
-                FROM
-                    reportings)
-                AND reportings.report = 'positions'
-    """
-opus = OpusSource()
-
-
-def get_hedge(id: str) -> pd.DataFrame:
-    portfolio = opus.read_sql(query=hedge_query.format(mandate=id))
-    nav = portfolio['value'].sum()
-
-    # Adjustments
-    portfolio = portfolio[
-        (portfolio['asset_class'] != "BOND") &
-        (portfolio['dr_class_level_1'] != "FIXED INCOME")
-    ]
-
-    # Need to ignore FX Future, total_exposure is already in base currency
-    ignore_mask = (portfolio["asset_class"] == "FUTURE") & (portfolio["dr_class_level_1"] == "FX")
-
-    portfolio.loc[(portfolio["asset_class"] == "FOREX") & (~ignore_mask), "total_exposure"] *= (
-                1 / portfolio["last_xrate_quantity"])
-
-    portfolio.loc[(portfolio["asset_class"] != "FOREX") & (~ignore_mask), "total_exposure"] *= portfolio[
-        "last_xrate_quantity"]
-
-    portfolio["total_exposure_pct"] = portfolio["total_exposure"] / nav
-
-    # Calcs
-    cash_mask = portfolio["asset_class"] == "CASH"
-
-    stocks_mask = portfolio["asset_class"] == "STOCK"
-    futures_mask = (portfolio["asset_class"] == "FUTURE") & (portfolio["dr_class_level_1"] == "EQUITY")
-
-    futures_fx_mask = ((portfolio["asset_class"] == "FUTURE") & (portfolio["dr_class_level_1"] == "FX"))
-    forex_mask = (portfolio["asset_class"] == "FOREX")
-
-    portfolio.loc[portfolio['asset_class'] == 'FOREX', 'Currency'] = portfolio['forex_trade_currency']
-
-    currency = portfolio.groupby('Currency').apply(lambda df: pd.Series({
-        'Stocks': df.loc[stocks_mask, 'total_exposure_pct'].sum() * 100,
-        'Cash': df.loc[cash_mask, 'total_exposure_pct'].sum() * 100,
-        'Futures': df.loc[futures_mask, 'percent_nav'].sum(),
-        'Forex': df.loc[futures_fx_mask, 'total_exposure_pct'].sum() * -1 * 100 + df.loc[forex_mask, 'total_exposure_pct'].sum() * 100
-    })).reset_index()
-
-    currency["Sum"] = currency[["Stocks", "Cash", "Futures", "Forex"]].sum(axis=1)
-    total_row = pd.DataFrame(currency[["Stocks", "Cash", "Futures", "Forex", "Sum"]].sum()).T
-    total_row["Currency"] = "Total"
-    currency = pd.concat([currency, total_row], ignore_index=True)
-    currency.set_index('Currency', inplace=True)
 
-    return currency
+hedge_buckets = ['Stocks', 'Cash', 'Futures', 'Forex']
 
 
-def get_benchmark_positions() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    sxxp = pd.read_excel('data.xlsx', sheet_name="SXXP Index", header=0, index_col=0)
-    spx = pd.read_excel('data.xlsx', sheet_name="SPX Index", header=0, index_col=0)
-
-    sxxp = calculate_initials_weights(sxxp)
-    spx = calculate_initials_weights(spx)
-
-    sxxp = calculate_current_weights(sxxp)
-    spx = calculate_current_weights(spx)
-
-    benchmark = combine_benchmarks(sxxp, spx, sxxp_weight=0.6, spx_weight=0.4)
-
-    return sxxp, spx, benchmark
-
-
-def combine_benchmarks(sxxp: pd.DataFrame, spx: pd.DataFrame, sxxp_weight: float = 0.6,
-                       spx_weight: float = 0.4) -> pd.DataFrame:
-    sxxp = sxxp.copy()
-    spx = spx.copy()
-    sxxp['initial_weight'] = sxxp['initial_weight'] * sxxp_weight
-    spx['initial_weight'] = spx['initial_weight'] * spx_weight
+def get_hedges(ids: Iterable[str]) -> pd.DataFrame:
+    """
+    Currency exposure of several mandates in one aggregation. Every position is tagged with its bucket
+    (Stocks, Cash, Futures, Forex) and its exposure in % of the mandate's NAV, then summed by
+    mandate x currency x bucket.
 
-    sxxp['current_weight'] = sxxp['current_weight'] * sxxp_weight
-    spx['current_weight'] = spx['current_weight'] * spx_weight
+    Args:
+        ids (Iterable[str]): Accountsegment ids of the mandates.
 
-    benchmark = pd.concat([sxxp, spx])
+    Returns:
+        pd.DataFrame: Exposure indexed by (accountsegment_id, Currency) with a 'Total' row per mandate,
+        columns Stocks, Cash, Futures, Forex and Sum.
+    """
+    portfolio = market_data.snapshot.select('hedge', accountsegment_ids=ids)
+    nav = portfolio.groupby('accountsegment_id')['value'].transform('sum')
 
-    return benchmark
+    # Adjustments
+    keep = (portfolio['asset_class'] != "BOND") & (portfolio['dr_class_level_1'] != "FIXED INCOME")
+    portfolio, nav = portfolio[keep], nav[keep]
+    asset_class, level_1 = portfolio['asset_class'], portfolio['dr_class_level_1']
+
+    # FX Futures are already in base currency, Forex exposure is quoted the other way round
+    fx_futures = (asset_class == "FUTURE") & (level_1 == "FX")
+    forex = asset_class == "FOREX"
+    futures = (asset_class == "FUTURE") & (level_1 == "EQUITY")
+    xrate = portfolio['last_xrate_quantity']
+    exposure_pct = portfolio['total_exposure'] * np.where(fx_futures, 1, np.where(forex, 1 / xrate, xrate)) / nav * 100
+
+    lines = pd.DataFrame({
+        'accountsegment_id': portfolio['accountsegment_id'],
+        'Currency': portfolio['Currency'].where(~forex, portfolio['forex_trade_currency']),
+        'bucket': np.select([asset_class == "STOCK", asset_class == "CASH", futures, fx_futures | forex],
+                            hedge_buckets, default=''),
+        'exposure': np.select([futures, fx_futures], [portfolio['percent_nav'], -exposure_pct], default=exposure_pct)
+    })
 
+    currency = (lines.groupby(['accountsegment_id', 'Currency', 'bucket'])['exposure'].sum()
+                .unstack('bucket', fill_value=0).reindex(columns=hedge_buckets, fill_value=0))
+    currency.columns.name = None
+    currency['Sum'] = currency.sum(axis=1)
 
-def group(df: pd.DataFrame, group_by_col: str, sum_col: str) -> pd.DataFrame:
-    grouped = df.groupby(group_by_col).agg({
-        sum_col: 'sum'
-    })
+    totals = currency.groupby(level='accountsegment_id').sum()
+    totals.index = pd.MultiIndex.from_product([totals.index, ['Total']], names=currency.index.names)
+    return pd.concat([currency, totals]).sort_index(level='accountsegment_id', sort_remaining=False, kind='stable')
 
-    grouped = grouped.reset_index()
-    grouped.set_index(group_by_col, inplace=True)
 
-    return grouped
+def get_hedge(id: str) -> pd.DataFrame:
+    return get_hedges([id]).loc[str(id)]
 
 
-def calculate_initials_weights(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.dropna(axis=0)
-    num_stocks = len(df)
-    equal_weight = 1 / num_stocks
+class Benchmark:
+    """
+    Equally weighted index benchmark as of its last rebalancing. Share counts and initial weights are
+    fixed when the benchmark is built, current weights are recomputed from a price vector only.
+    """
 
     cap_factor = 100_000_000_000.0
 
-    amount = cap_factor * equal_weight
-
-    df['num_stocks'] = (amount / df['#px_close']).astype(int)
-    df['initial_value'] = df['num_stocks'] * df['#px_close']
+    def __init__(self, constituents: pd.DataFrame):
+        """
+        Args:
+            constituents (pd.DataFrame): Index sheet with '#px_close' at the rebalancing and '#px_last'.
+        """
+        self.constituents = constituents.dropna(axis=0)
+        amount = self.cap_factor / len(self.constituents)
+
+        self.num_stocks = (amount / self.constituents['#px_close']).astype(int).to_numpy()
+        self.initial_value = self.num_stocks * self.constituents['#px_close'].to_numpy()
+        self.initial_weight = self.initial_value / self.initial_value.sum() * 100
+        self._price(self.constituents['#px_last'])
+
+    def _price(self, prices: pd.Series):
+        self.prices = prices.reindex(self.constituents.index).to_numpy(dtype=float)
+        self.current_value = self.num_stocks * self.prices
+        self.current_weight = self.current_value / np.nansum(self.current_value) * 100
+
+    def update(self, prices: pd.Series) -> 'Benchmark':
+        """
+        Benchmark at new last prices, indexed like the constituents. Returns a new benchmark, this one is
+        cached by get_benchmark and shared by the report stages.
+        """
+        benchmark = copy.copy(self)
+        benchmark._price(prices)
+        return benchmark
+
+    def positions(self, weight: float = 1.0) -> pd.DataFrame:
+        """
+        Constituents with share counts, values and weights in %, weights scaled by the blend weight.
+        """
+        return self.constituents.assign(**{
+            '#px_last': self.prices,
+            'num_stocks': self.num_stocks,
+            'initial_value': self.initial_value,
+            'initial_weight': self.initial_weight * weight,
+            'current_value': self.current_value,
+            'current_weight': self.current_weight * weight,
+        })
+
+
+@lru_cache(maxsize=None)
+def get_benchmark(index: str) -> Benchmark:
+    """
+    Benchmark of an index sheet of the workbook, e.g. 'SXXP Index', built once per run.
+    """
+    return Benchmark(read_sheet(index))
 
-    total_initial_value = df['initial_value'].sum()
-    df['initial_weight'] = df['initial_value'] / total_initial_value * 100
 
-    return df
+def blend_benchmarks(weights: Dict[str, float]) -> pd.DataFrame:
+    """
+    Positions of a benchmark mix, e.g. {'SXXP Index': 0.6, 'SPX Index': 0.4}, from the cached benchmarks.
 
+    Args:
+        weights (Dict[str, float]): Weight of each index sheet, summing up to 1.
+    """
+    if not np.isclose(sum(weights.values()), 1):
+        raise ValueError(f"Benchmark weights must sum up to 1, got {sum(weights.values())}.")
+    return pd.concat([get_benchmark(index).positions(weight) for index, weight in weights.items()])
 
-def calculate_current_weights(df: pd.DataFrame) -> pd.DataFrame:
-    df['current_value'] = df['num_stocks'] * df['#px_last']
 
-    total_current_value = df['current_value'].sum()
-    df['current_weight'] = df['current_value'] / total_current_value * 100
+def get_benchmark_positions() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    sxxp = get_benchmark("SXXP Index").positions()
+    spx = get_benchmark("SPX Index").positions()
+    benchmark = blend_benchmarks({"SXXP Index": 0.6, "SPX Index": 0.4})
 
-    return df
+    return sxxp, spx, benchmark
 
 
 def get_account_positions(id: str) -> pd.DataFrame:
-    df = opus.read_sql(query=query.format(mandate=id))
+    df = market_data.snapshot.select('allocation', accountsegment_ids=[id])
     df.set_index('position_name', inplace=True)
     df['Exposure'] = (df['total_exposure'] * df['last_xrate_quantity']) / df['nav'] * 100
     return df
 
 
 def adjust_for_futures(portfolio: pd.DataFrame):
+    """
+    Look through index futures into sectors and regions. The exposure of every future whose underlying
+    is in the index composition is spread over the sectors in one step, diag(exposures) x sector weight
+    matrix, and appended as one row per future and sector.
+    """
     futures = portfolio[portfolio['asset_class'] == 'FUTURE']
 
     if not futures.empty:
-        sector_alloc = pd.read_excel('data.xlsx', sheet_name='Sector', header=4, index_col=0)
-        sectors = sector_alloc.iloc[:, 3:]
-        sectors.drop(["null", "NullGroup"], axis=1, inplace=True, errors="ignore")
-        sectors = sectors.div(sectors.sum(axis=1), axis=0).mul(100)
-
-        new_rows = []
-
-        for _, future in futures.iterrows():
-            underlying = future['underlying_name']
-            exposure = future['Exposure']
-
-            if underlying in sectors.index:
-                sector_weights = sectors.loc[underlying] * exposure / 100
-
-                for sector, weight in sector_weights.items():
-                    new_row = {
-                        'position_name': f"{underlying}_{sector}",
-                        'asset_class': 'FUTURE',
-                        'underlying_name': underlying,
-                        'Exposure': weight,
-                        'country': sector_alloc.loc[underlying, "Region"],
-                        'Sector': sector
-                    }
-                    new_rows.append(new_row)
-
-        if new_rows:
-            new_rows_df = pd.DataFrame(new_rows)
+        weights, regions = market_data.index_composition
+        futures = futures[futures['underlying_name'].isin(weights.index)]
+
+        if not futures.empty:
+            underlyings = futures['underlying_name'].to_numpy()
+            exposure = weights.loc[underlyings].to_numpy() * futures['Exposure'].to_numpy()[:, None] / 100
+
+            n_sectors = len(weights.columns)
+            underlyings = np.repeat(underlyings, n_sectors)
+            sectors = np.tile(weights.columns.to_numpy(), len(futures))
+
+            new_rows_df = pd.DataFrame({
+                'position_name': pd.Series(underlyings).astype(str) + '_' + pd.Series(sectors).astype(str),
+                'asset_class': 'FUTURE',
+                'underlying_name': underlyings,
+                'Exposure': exposure.ravel(),
+                'country': regions.loc[underlyings].to_numpy(),
+                'Sector': sectors
+            })
             portfolio = pd.concat([portfolio, new_rows_df], ignore_index=True)
 
     return portfolio
 
 
-def plot_combined_dataframe(benchmark: pd.DataFrame, portfolio: pd.DataFrame, name: str) -> (str, str):
+def active_weight_cube(benchmark: pd.DataFrame, portfolio: pd.DataFrame) -> pd.DataFrame:
+    """
+    Benchmark and portfolio weights in % summed by (Sector, Country, US) in one groupby. Every breakdown
+    of the allocation report is a slice or rollup of this cube, see active_weights.
+
+    Args:
+        benchmark (pd.DataFrame): Combined benchmark data.
+        portfolio (pd.DataFrame): Portfolio data, futures looked through.
+    """
+    weights = pd.concat([
+        pd.DataFrame({'Sector': benchmark['gics_sector_name'], 'Country': benchmark['cntry_issue_iso'],
+                      'Source': 'Benchmark', 'Weight': benchmark['current_weight']}),
+        pd.DataFrame({'Sector': portfolio['Sector'], 'Country': portfolio['country'],
+                      'Source': 'Portfolio', 'Weight': portfolio['Exposure']})
+    ], ignore_index=True)
+    weights['US'] = weights['Country'] == 'US'
+
+    cube = (weights.groupby(['Sector', 'Country', 'US', 'Source'], dropna=False)['Weight'].sum()
+            .unstack('Source', fill_value=0).reindex(columns=['Benchmark', 'Portfolio'], fill_value=0))
+    cube.columns.name = None
+    return cube
+
+
+def active_weights(cube: pd.DataFrame, by: str, mask: np.ndarray = None) -> pd.DataFrame:
+    """
+    Benchmark, portfolio and active weights by one level of the cube, rows with a missing key are dropped.
+
+    Args:
+        cube (pd.DataFrame): Result of active_weight_cube.
+        by (str): Level to roll up to, 'Sector' or 'Country'.
+        mask (np.ndarray): Rows of the cube to include, e.g. the US level.
+    """
+    df = (cube if mask is None else cube[mask]).groupby(level=by).sum()
+    df['Difference'] = df['Portfolio'] - df['Benchmark']
+    return df
+
+
+def plot_combined_dataframe(benchmark: pd.DataFrame, portfolio: pd.DataFrame, name: str) -> (Future, Future):
     """
     Plot combined DataFrame for sector and country, showing benchmark weights, portfolio weights, and their differences.
 
@@ -250,16 +234,9 @@ def plot_combined_dataframe(benchmark: pd.DataFrame, portfolio: pd.DataFrame, na
     """
     portfolio['Sector'] = portfolio['Sector'].str.extract(r'\d+\s*(.*)')[0]
     portfolio = adjust_for_futures(portfolio)
+    cube = active_weight_cube(benchmark, portfolio)
+    us = cube.index.get_level_values('US').to_numpy(dtype=bool)
 
-    benchmark_sector = group(benchmark, 'gics_sector_name', 'current_weight')
-    portfolio_sector = group(portfolio, 'Sector', 'Exposure')
-
-    combined_sector = pd.merge(benchmark_sector, portfolio_sector, left_index=True, right_index=True, how='outer',
-                               suffixes=('_benchmark', '_portfolio')).fillna(0)
-    combined_sector.columns = ['Benchmark', 'Portfolio']
-    combined_sector['Difference'] = combined_sector['Portfolio'] - combined_sector['Benchmark']
-
-    combined_sector.index.name = "EU/US Sector"
     sector_mapping = {
         'Information Technology': '45 Information Technology',
         'Health Care': '35 Health Care',
@@ -273,81 +250,38 @@ def plot_combined_dataframe(benchmark: pd.DataFrame, portfolio: pd.DataFrame, na
         'Real Estate': '60 Real Estate',
         'Communication Services': '50 Communication Services'
     }
-    combined_sector.index = combined_sector.index.map(sector_mapping)
-    combined_sector = combined_sector.sort_index()
-    combined_sector.loc['Sum'] = combined_sector.sum()
-
-    sector = style_and_export_combined(combined_sector, name, "Sector")
-
-    benchmark_region = benchmark.dropna(subset=['cntry_issue_iso'])
-    benchmark_region = group(benchmark_region, 'cntry_issue_iso', 'current_weight')
 
-    portfolio_region = portfolio.dropna(subset=['country'])
-    portfolio_region = group(portfolio_region, 'country', 'Exposure')
+    def sectors(mask: np.ndarray, index_name: str) -> pd.DataFrame:
+        df = active_weights(cube, 'Sector', mask)
+        df.index = df.index.map(sector_mapping)
+        df = df.sort_index()
+        df.loc['Sum'] = df.sum()
+        df.index.name = index_name
+        return df
 
-    combined = pd.merge(benchmark_region, portfolio_region, left_index=True, right_index=True, how='outer',
-                               suffixes=('_benchmark', '_portfolio')).fillna(0)
-    combined.columns = ['Benchmark', 'Portfolio']
+    sector = style_and_export_combined(sectors(None, "EU/US Sector"), name, "Sector")
 
-    combined['Difference'] = combined['Portfolio'] - combined['Benchmark']
+    combined = active_weights(cube, 'Country')
+    combined.index.name = None
     style_and_export_combined(combined, name, "Region_All")
 
-    combined['Abs_Difference'] = combined['Difference'].abs()
-    filtered_combined = combined[combined['Abs_Difference'] > 2]
-    other_row = combined[combined['Abs_Difference'] <= 2].sum()
+    large = combined['Difference'].abs() > 2
+    other_row = combined[~large].sum()
     other_row.name = 'Other'
-    filtered_combined = pd.concat([filtered_combined, other_row.to_frame().T])
-    filtered_combined = filtered_combined.drop(columns=['Abs_Difference'])
+    filtered_combined = pd.concat([combined[large], other_row.to_frame().T])
     filtered_combined.loc['Sum'] = filtered_combined.sum()
-
     filtered_combined.index.name = "Region"
 
     region = style_and_export_combined(filtered_combined, name, "Region")
 
-    # US and Non-US Stocks Processing
-    us_country_code = 'US'
-    benchmark_us = benchmark[benchmark['cntry_issue_iso'] == us_country_code]
-    portfolio_us = portfolio[portfolio['country'] == us_country_code]
-    benchmark_non_us = benchmark[benchmark['cntry_issue_iso'] != us_country_code]
-    portfolio_non_us = portfolio[portfolio['country'] != us_country_code]
-
-    benchmark_us_grouped = group(benchmark_us, 'gics_sector_name', 'current_weight')
-    portfolio_us_grouped = group(portfolio_us, 'Sector', 'Exposure')
-
-    combined_us = pd.merge(benchmark_us_grouped, portfolio_us_grouped, left_index=True, right_index=True, how='outer',
-                           suffixes=('_benchmark', '_portfolio')).fillna(0)
-    combined_us.columns = ['Benchmark', 'Portfolio']
-    combined_us['Difference'] = combined_us['Portfolio'] - combined_us['Benchmark']
-
-    combined_us.index = combined_us.index.map(sector_mapping)
-    combined_us = combined_us.sort_index()
-    combined_us.loc['Sum'] = combined_us.sum()
-    combined_us.index.name = "US Sector"
-
-    us_stocks_chart = style_and_export_combined(combined_us, name, "US_Stocks")
-
-    # Group Non-US Data
-    benchmark_non_us_grouped = group(benchmark_non_us, 'gics_sector_name', 'current_weight')
-    portfolio_non_us_grouped = group(portfolio_non_us, 'Sector', 'Exposure')
-
-    combined_non_us = pd.merge(benchmark_non_us_grouped, portfolio_non_us_grouped, left_index=True, right_index=True,
-                               how='outer',
-                               suffixes=('_benchmark', '_portfolio')).fillna(0)
-    combined_non_us.columns = ['Benchmark', 'Portfolio']
-    combined_non_us['Difference'] = combined_non_us['Portfolio'] - combined_non_us['Benchmark']
-
-    combined_non_us.index = combined_non_us.index.map(sector_mapping)
-    combined_non_us = combined_non_us.sort_index()
-    combined_non_us.loc['Sum'] = combined_non_us.sum()
-    combined_non_us.index.name = "EU Sector"
-
-    # Export Non-US Stocks Chart
-    non_us_stocks_chart = style_and_export_combined(combined_non_us, name, "EU_Stocks")
+    # US and Non-US Stocks
+    us_stocks_chart = style_and_export_combined(sectors(us, "US Sector"), name, "US_Stocks")
+    non_us_stocks_chart = style_and_export_combined(sectors(~us, "EU Sector"), name, "EU_Stocks")
 
     return sector, region
 
 
-def style_and_export_combined(df: pd.DataFrame, fund: str, kind: str) -> str:
+def style_and_export_combined(df: pd.DataFrame, fund: str, kind: str) -> Future:
     """
     Style the combined DataFrame and export it as an image.
 
@@ -384,11 +318,10 @@ def style_and_export_combined(df: pd.DataFrame, fund: str, kind: str) -> str:
             'Difference': "{:.2f}%"
         }))
     path = f'output/allocation/{kind}_Exposure_{fund.replace("&", "_").replace(" ", "_")}.png'
-    dfi.export(styled, path, table_conversion="selenium")
-    return path
+    return export(styled, path)
 
 
-def plot_hedge(df: pd.DataFrame, fund: str):
+def plot_hedge(df: pd.DataFrame, fund: str) -> Future:
     styled = (
         df.style
         .set_table_styles([
@@ -412,8 +345,7 @@ def plot_hedge(df: pd.DataFrame, fund: str):
         }))
 
     path = f'output/allocation/Hedge_{fund.replace("&", "_").replace(" ", "_")}.png'
-    dfi.export(styled, path, table_conversion="selenium")
-    return path
+    return export(styled, path)
 
 
 def generate_allocation_report():
@@ -432,7 +364,7 @@ def generate_allocation_report():
         'Currency Exposure': hedge_chart
     }
 
-    return mail_data
+    return collect(mail_data)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,33 @@
+import logging
+import re
+import threading
+import warnings
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
 import pandas as pd
 from source_engine.opus_source import OpusSource
 
-from utility import calc_universe_rel_performance_vs_sector
+import history
+from opus_pool import QueryPool
+from rules import Rule, load_rules, quantile_name, screen
+from snapshots import OPUS_SQLITE, REPLAY_DATE, SnapshotStore, SQLiteSource
+from utility import calc_universe_rel_performance_vs_sector, cap_weighted, drawdowns
+from workbook import read_sheet
 
-opus = OpusSource()
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_opus() -> QueryPool:
+    if OPUS_SQLITE:
+        return QueryPool(lambda: SQLiteSource(OPUS_SQLITE))
+    return QueryPool(OpusSource)
+
+
+snapshot_store = SnapshotStore(get_opus, replay=bool(REPLAY_DATE))
 
 
 mandate = {
@@ -13,20 +37,47 @@ mandate = {
     'D&R Premium Select': '93708903'
 }
 
-futures = f"""
+# Segments of the third party funds, as SQL LIKE patterns on accountsegments.name
+third_party_segments = ['%VV-ESG%', '%VV-Flex%', '%Strategie - Select', '%Premium Select%']
+
+report_date_query = """
     SELECT
-        accountsegments.name, 
-        accountsegments.nav,
+        MAX(report_date) as report_date
+    FROM
+        reportings
+"""
+
+positions_query = """
+    SELECT
+        accountsegments.accountsegment_id,
         accountsegments.account_id,
-        reportings.report_date, 
+        accountsegments.name as segment_name,
+        accountsegments.nav,
+        accountsegments.currency as base_currency,
+        reportings.report_date,
         positions.name as position_name,
+        positions.isin,
+        positions.bloomberg_query,
+        positions.asset_class,
+        positions.dr_class_level_1,
+        positions.dr_class_level_2,
         positions.average_entry_quote,
+        positions.average_entry_xrate,
+        positions.last_xrate_quantity,
+        positions.last_quote,
         positions.volume,
+        positions.eff_volume,
         positions.position_type,
         positions.underlying_name,
         positions.price_per_point,
-        positions.last_xrate_quantity,
-        positions.total_exposure
+        positions.total_exposure,
+        positions.value_base_ccy,
+        positions.percent_nav,
+        positions.profit_and_loss_percent,
+        positions.currency,
+        positions.forex_trade_currency,
+        positions.country_of_domicile,
+        positions.gics_industry_sector
     FROM
         reportings
             JOIN
@@ -37,89 +88,118 @@ futures = f"""
             positions.account_segment_id = accountsegments.accountsegment_id
             AND reportings.newest = 1
             AND reportings.report = 'positions'
-            AND positions.asset_class = 'FUTURE'
-            AND positions.dr_class_level_1 = 'EQUITY'
-            AND accountsegments.accountsegment_id in ({', '.join(mandate.values())})
-            AND reportings.report_date = (SELECT
-                                            MAX(report_date)
-                                          FROM
-                                            reportings)
+            AND reportings.report_date = '{report_date}'
+            AND (accountsegments.accountsegment_id in ({accountsegment_ids})
+                 OR {segment_names})
 """
 
-stocks = f"""
-    SELECT
-        accountsegment_id,
-        account_id,
-        accountsegments.name as Name, 
-        reportings.report_date, 
-        positions.name as 'Position Name',
-        positions.isin as ISIN,
-        positions.bloomberg_query as Query,
-        positions.average_entry_quote as AEQ,
-        positions.average_entry_xrate as AEX,
-        positions.currency as Crncy,
-        positions.last_quote,
-        positions.volume as Volume,
-        positions.gics_industry_sector as Sector,
-        positions.dr_class_level_2 as 'Region'
-    FROM
-        reportings
-            JOIN
-        accountsegments ON (accountsegments.reporting_uuid = reportings.uuid)
-            JOIN
-        positions ON (reportings.uuid = positions.reporting_uuid)
-    WHERE
-            positions.account_segment_id = accountsegments.accountsegment_id
-            AND reportings.newest = 1
-            AND reportings.report = 'positions'
-            AND positions.asset_class = 'STOCK'
-            AND accountsegments.accountsegment_id in ({', '.join(mandate.values())})
-            AND reportings.report_date = (SELECT
-                                            MAX(report_date)
-                                          FROM
-                                            reportings)
-"""
+# Slices of the position snapshot served to the reports: asset classes, dr_class_level_1 and the
+# snapshot columns with the names the reports expect
+position_views = {
+    'stocks': (['STOCK'], None, {
+        'accountsegment_id': 'accountsegment_id', 'account_id': 'account_id', 'segment_name': 'Name',
+        'report_date': 'report_date', 'position_name': 'Position Name', 'isin': 'ISIN', 'bloomberg_query': 'Query',
+        'average_entry_quote': 'AEQ', 'average_entry_xrate': 'AEX', 'currency': 'Crncy', 'last_quote': 'last_quote',
+        'volume': 'Volume', 'gics_industry_sector': 'Sector', 'dr_class_level_2': 'Region'}),
+    'futures': (['FUTURE'], 'EQUITY', {
+        'segment_name': 'name', 'nav': 'nav', 'account_id': 'account_id', 'report_date': 'report_date',
+        'position_name': 'position_name', 'average_entry_quote': 'average_entry_quote', 'volume': 'volume',
+        'position_type': 'position_type', 'underlying_name': 'underlying_name', 'price_per_point': 'price_per_point',
+        'last_xrate_quantity': 'last_xrate_quantity', 'total_exposure': 'total_exposure'}),
+    'third_party': (['FUND_CLASS', 'CERTIFICATE'], None, {
+        'segment_name': 'Name', 'account_id': 'account_id', 'report_date': 'report_date', 'bloomberg_query': 'Query',
+        'position_name': 'Position Name', 'average_entry_quote': 'AEQ', 'volume': 'Volume',
+        'last_xrate_quantity': 'AEX'}),
+    'allocation': (['STOCK', 'FUTURE'], 'EQUITY', {
+        'segment_name': 'name', 'account_id': 'account_id', 'nav': 'nav', 'report_date': 'report_date',
+        'position_name': 'position_name', 'asset_class': 'asset_class', 'value_base_ccy': 'value',
+        'bloomberg_query': 'bloomberg_query', 'underlying_name': 'underlying_name',
+        'total_exposure': 'total_exposure', 'last_xrate_quantity': 'last_xrate_quantity',
+        'country_of_domicile': 'country', 'gics_industry_sector': 'Sector'}),
+    'hedge': (None, None, {
+        'accountsegment_id': 'accountsegment_id', 'base_currency': 'base_currency', 'position_name': 'name', 'isin': 'isin', 'asset_class': 'asset_class',
+        'bloomberg_query': 'bloomberg_query', 'currency': 'Currency', 'eff_volume': 'volume',
+        'position_type': 'position_type', 'forex_trade_currency': 'forex_trade_currency',
+        'average_entry_quote': 'average_entry_quote', 'last_quote': 'last_quote',
+        'total_exposure': 'total_exposure', 'last_xrate_quantity': 'last_xrate_quantity', 'value_base_ccy': 'value',
+        'percent_nav': 'percent_nav', 'profit_and_loss_percent': 'profit_and_loss_percent',
+        'country_of_domicile': 'country', 'gics_industry_sector': 'sector', 'dr_class_level_1': 'dr_class_level_1'}),
+}
+
+
+def _like(pattern: str) -> re.Pattern:
+    return re.compile('^' + '.*'.join(re.escape(part) for part in pattern.split('%')) + '$', re.IGNORECASE)
 
-third_party = """
-    SELECT
-        accountsegments.name as Name, 
-        accountsegments.account_id,
-        reportings.report_date, 
-        positions.bloomberg_query as Query,
-        positions.name as 'Position Name',
-        positions.average_entry_quote as AEQ,
-        positions.volume as Volume,
-        positions.last_xrate_quantity as AEX
-    FROM
-        reportings
-            JOIN
-        accountsegments ON (accountsegments.reporting_uuid = reportings.uuid)
-            JOIN
-        positions ON (reportings.uuid = positions.reporting_uuid)
-    WHERE
-            positions.account_segment_id = accountsegments.accountsegment_id
-            AND reportings.newest = 1
-            AND reportings.report = 'positions'
-            AND positions.asset_class in ('FUND_CLASS', 'CERTIFICATE')
-            AND (accountsegments.name LIKE "%VV-ESG%" OR accountsegments.name LIKE "%VV-Flex%" OR accountsegments.name LIKE "%Strategie - Select" OR accountsegments.name LIKE "%Premium Select%")
-            AND reportings.report_date = (SELECT
-                                            MAX(report_date)
-                                          FROM
-                                            reportings)
-"""
+
+class PositionSnapshot:
+    """
+    Newest positions of all mandates and third party segments, loaded with two queries per run: the latest
+    report date, then every position of that date. The reports are served from in-memory slices keyed by
+    accountsegment_id and asset_class instead of querying the warehouse per mandate and report.
+
+    The positions are read through the snapshot store, a report_date given replays a stored date
+    without asking the warehouse for the latest one. Only a replay (REPORT_DATE) serves stored positions.
+    """
+
+    def __init__(self, accountsegment_ids: Iterable[str] = None, segment_names: Iterable[str] = None,
+                 report_date: str = None):
+        self.accountsegment_ids = [str(i) for i in (mandate.values() if accountsegment_ids is None else accountsegment_ids)]
+        self.segment_names = list(third_party_segments if segment_names is None else segment_names)
+
+        if report_date is None:
+            report_date = get_opus().read_sql(query=report_date_query, name='report_date')['report_date'].iloc[0]
+        self.report_date = pd.Timestamp(report_date)
+
+        self.frame = snapshot_store.read_sql(report_date=self.report_date, query=positions_query.format(
+            report_date=self.report_date.strftime('%Y-%m-%d %H:%M:%S'),
+            accountsegment_ids=', '.join(f"'{i}'" for i in self.accountsegment_ids),
+            segment_names=' OR '.join(f'accountsegments.name LIKE "{name}"' for name in self.segment_names) or 'FALSE'))
+        self.frame['accountsegment_id'] = self.frame['accountsegment_id'].astype(str)
+
+        self._groups = self.frame.groupby(['accountsegment_id', 'asset_class'], sort=False).indices
+        self._names = self.frame.groupby('accountsegment_id', sort=False)['segment_name'].first()
+
+    def select(self, view: str, accountsegment_ids: Iterable[str] = None, segment_names: Iterable[str] = None) -> pd.DataFrame:
+        """
+        Positions of some segments in the shape of one of the position_views.
+
+        Args:
+            view (str): Name of the view, a key of position_views.
+            accountsegment_ids (Iterable[str]): Segments by id, must be part of the snapshot.
+            segment_names (Iterable[str]): Segments by name as SQL LIKE patterns, must be part of the snapshot.
+        """
+        if view not in position_views:
+            raise ValueError(f"Unknown position view '{view}'.")
+        asset_classes, level_1, columns = position_views[view]
+
+        ids = [str(i) for i in accountsegment_ids or []]
+        missing = set(ids) - set(self.accountsegment_ids)
+        missing |= set(segment_names or []) - set(self.segment_names)
+        if missing:
+            raise ValueError(f"Segments {sorted(missing)} are not part of the position snapshot.")
+        for pattern in map(_like, segment_names or []):
+            ids += [i for i, name in self._names.items() if pattern.match(name)]
+
+        rows = [index for (segment, asset_class), index in self._groups.items()
+                if segment in ids and (asset_classes is None or asset_class in asset_classes)]
+        df = self.frame.iloc[np.sort(np.concatenate(rows)) if rows else []]
+        if level_1 is not None:
+            df = df[df['dr_class_level_1'] == level_1]
+
+        return df[list(columns)].rename(columns=columns).reset_index(drop=True)
 
 
 def get_account_futures() -> pd.DataFrame:
-    df = opus.read_sql(query=futures)
+    df = market_data.snapshot.select('futures', accountsegment_ids=mandate.values())
     df.set_index(['name', 'position_name'], inplace=True)
     return df
 
 
 def get_positions() -> pd.DataFrame:
-    df = opus.read_sql(query=stocks)
+    df = market_data.snapshot.select('stocks', accountsegment_ids=mandate.values())
     df['AEQ'] = df['AEQ'] * df['AEX']
 
-    positions = pd.merge(df, single_stocks[['bloomberg_query', 'isin', 'Last Price', '1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High']],
+    positions = pd.merge(df, market_data.single_stocks[['bloomberg_query', 'isin', 'Last Price', '1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High']],
                          left_on='ISIN', right_on='isin',
                          how='left')
 
@@ -127,10 +207,7 @@ def get_positions() -> pd.DataFrame:
     for col in ['Last Price', 'AEQ', '1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High']:
         positions[col] = pd.to_numeric(positions[col], errors='coerce').fillna(0)
 
-    positions['Last Price'] = positions.apply(
-        lambda row: row['last_quote'] if row['Last Price'] == 0 else row['Last Price'],
-        axis=1
-    )
+    positions['Last Price'] = positions['Last Price'].mask(positions['Last Price'] == 0, positions['last_quote'])
 
     positions.set_index(['Name', 'Position Name'], inplace=True)
     positions['% since AEQ'] = pd.to_numeric(((positions['Last Price'] - positions['AEQ']) / positions['AEQ']) * 100, errors='coerce')
@@ -138,7 +215,7 @@ def get_positions() -> pd.DataFrame:
 
 
 def get_futures_data() -> pd.DataFrame:
-    data = pd.read_excel('data.xlsx', sheet_name="Futures", header=0, skiprows=[1, 2], index_col=0)
+    data = read_sheet("Futures")
     data.index = pd.to_datetime(data.index, errors='coerce')
     data = data.sort_index()
 
@@ -146,10 +223,10 @@ def get_futures_data() -> pd.DataFrame:
 
 
 def get_universe_data(universe: str) -> pd.DataFrame:
-    universe = pd.read_excel('data.xlsx', sheet_name=universe, header=0)
+    universe = read_sheet(universe)
     universe.fillna(0, inplace=True)
     universe = universe.rename(
-        columns={'name': 'Name', 'gics_sector_name': 'Sector', 'CURRENT_TRR_1D': '1D',
+        columns={'ID': 'Query', 'name': 'Name', 'gics_sector_name': 'Sector', 'CURRENT_TRR_1D': '1D',
                  'CURRENT_TRR_5D': '5D', 'CURRENT_TRR_1MO': '1MO', 'CURRENT_TRR_YTD': 'YTD',
                  'CHG_PCT_MOV_AVG_200D': 'Δ 200D Mvag', 'CHG_PCT_HIGH_52WEEK': 'Δ 52 Week High'})
     universe = universe[universe['Sector'] != 0]
@@ -157,7 +234,7 @@ def get_universe_data(universe: str) -> pd.DataFrame:
 
 
 def get_regions_data() -> pd.DataFrame:
-    regions = pd.read_excel('data.xlsx', sheet_name="Regions", header=0, index_col=1)
+    regions = read_sheet("Regions")
     regions.fillna(0, inplace=True)
     regions.drop("Index", axis=1, inplace=True)
     regions = regions.rename(
@@ -168,10 +245,10 @@ def get_regions_data() -> pd.DataFrame:
 
 
 def get_third_party_products() -> pd.DataFrame:
-    df = opus.read_sql(query=third_party)
+    df = market_data.snapshot.select('third_party', segment_names=third_party_segments)
     df['AEQ'] = df['AEQ'] * df['AEX']
 
-    df = pd.merge(df, funds[['bloomberg_query', 'Last Price', '1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High']],
+    df = pd.merge(df, market_data.funds[['bloomberg_query', 'Last Price', '1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High']],
                   left_on='Query', right_on='bloomberg_query',
                   how='left')
 
@@ -183,7 +260,7 @@ def get_third_party_products() -> pd.DataFrame:
 
 
 def get_stocks_data() -> pd.DataFrame:
-    df = pd.read_excel('data.xlsx', sheet_name='Stocks', header=0)
+    df = read_sheet('Stocks')
     df.fillna(0, inplace=True)
     df = df.rename(columns={'CURRENT_TRR_1D': '1D', 'CURRENT_TRR_5D': '5D', 'CURRENT_TRR_1MO': '1MO', 'CURRENT_TRR_YTD': 'YTD',
                             'CHG_PCT_MOV_AVG_200D': 'Δ 200D Mvag', 'CHG_PCT_HIGH_52WEEK': 'Δ 52 Week High'})
@@ -191,7 +268,7 @@ def get_stocks_data() -> pd.DataFrame:
 
 
 def get_funds_data() -> pd.DataFrame:
-    df = pd.read_excel('data.xlsx', sheet_name='Funds', header=0)
+    df = read_sheet('Funds')
     df.fillna(0, inplace=True)
     df = df.rename(
         columns={'CURRENT_TRR_1D': '1D', 'CURRENT_TRR_5D': '5D', 'CURRENT_TRR_1MO': '1MO', 'CURRENT_TRR_YTD': 'YTD',
@@ -200,7 +277,7 @@ def get_funds_data() -> pd.DataFrame:
 
 
 def get_us_sector_data() -> pd.DataFrame:
-    df = pd.read_excel('data.xlsx', sheet_name='US Sector', header=0, index_col=0)
+    df = read_sheet('US Sector')
     df.drop('Query', inplace=True, axis=1)
     df.fillna(0, inplace=True)
     df = df.rename(columns={'CURRENT_TRR_1D': '1D', 'CURRENT_TRR_5D': '5D', 'CURRENT_TRR_1MO': '1MO', 'CURRENT_TRR_YTD': 'YTD',
@@ -209,131 +286,435 @@ def get_us_sector_data() -> pd.DataFrame:
 
 
 def get_eu_sector_data() -> pd.DataFrame:
-    df = pd.read_excel('data.xlsx', sheet_name='EU Sector', header=0)
+    df = read_sheet('EU Sector')
     df.drop('Query', inplace=True, axis=1)
     df.fillna(0, inplace=True)
     df = df.rename(columns={'CURRENT_TRR_1D': '1D', 'CURRENT_TRR_5D': '5D', 'CURRENT_TRR_1MO': '1MO', 'CURRENT_TRR_YTD': 'YTD',
                             'CHG_PCT_MOV_AVG_200D': 'Δ 200D Mvag', 'CHG_PCT_HIGH_52WEEK': 'Δ 52 Week High'})
 
-    def calculate_weighted_trrs(group):
-        weight = group['CUR_MKT_CAP'] / group['CUR_MKT_CAP'].sum()
-        d = {'1D': (group['1D'] * weight).sum(),
-             '5D': (group['5D'] * weight).sum(),
-             '1MO': (group['1MO'] * weight).sum(),
-             'YTD': (group['YTD'] * weight).sum(),
-             'Δ 200D Mvag': (group['Δ 200D Mvag'] * weight).sum(),
-             'Δ 52 Week High': (group['Δ 52 Week High'] * weight).sum(),
-             }
-        return pd.Series(d)
-
-    df = df.groupby('GICS').apply(calculate_weighted_trrs)
+    df = cap_weighted(df, by='GICS', columns=['1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High'])
     return df
 
 
-def calculate_quantiles(df: pd.DataFrame, columns: list) -> pd.DataFrame:
-    quantiles = {}
-    for column in columns:
-        quantiles[column] = {
-            '5th Quantile': df[column].quantile(0.05),
-            '95th Quantile': df[column].quantile(0.95)
-        }
-    df = pd.DataFrame(quantiles).transpose()
-    df = df.apply(lambda x: round(x * 2) / 2)
-    return df
+def get_index_composition() -> (pd.DataFrame, pd.Series):
+    """
+    Sector weights in % (one row per index, one column per sector) and region of the indices
+    the futures are looked through into.
+    """
+    sector_alloc = read_sheet('Sector')
+    sectors = sector_alloc.iloc[:, 3:].drop(["null", "NullGroup"], axis=1, errors="ignore")
+    return sectors.div(sectors.sum(axis=1), axis=0).mul(100), sector_alloc['Region']
+
+
+# Quantile bands computed for the screening thresholds
+quantile_levels = [0.01, 0.05, 0.10, 0.90, 0.95, 0.99]
+
+# Sectors with fewer constituents are screened with the thresholds of their region
+sector_quantile_min_count = 20
+
+
+def _nanquantile(values: np.ndarray, levels: List[float], axis) -> np.ndarray:
+    with warnings.catch_warnings():
+        # All-NaN columns give NaN thresholds, like pd.Series.quantile
+        warnings.simplefilter('ignore', RuntimeWarning)
+        quantiles = np.nanquantile(values, levels, axis=axis)
+    return np.round(quantiles * 2) / 2
+
+
+def calculate_quantiles(frames: Dict[str, pd.DataFrame], columns: List[str], levels: List[float] = quantile_levels,
+                        by: str = None, min_count: int = 1) -> pd.DataFrame:
+    """
+    Quantiles of many columns of many universes in one np.nanquantile call, rounded to 0.5. The rows of
+    every group are scattered into one NaN-padded groups x rows x columns array.
+
+    Args:
+        frames (Dict[str, pd.DataFrame]): Universes by name, e.g. {'US': market_data.us, 'EU': market_data.eu}.
+        columns (List[str]): Columns to compute the quantiles of.
+        levels (List[float]): Quantile levels, e.g. [0.05, 0.95].
+        by (str): Column to group the universes by as well, e.g. 'Sector' for quantiles per (universe, sector).
+        min_count (int): Groups with fewer values in a column get NaN quantiles for it.
+
+    Returns:
+        pd.DataFrame: Indexed by (universe, column) or (universe, by, column), one column per level
+        named like '5th Quantile'.
+    """
+    data = pd.concat({name: frame[columns + ([by] if by else [])] for name, frame in frames.items()})
+    # Categorical keys would sort by category order, group on the plain values
+    keys = [data.index.get_level_values(0)] + ([data[by].astype(object)] if by else [])
+    groups = data.groupby(keys, sort=True)
+
+    group_keys = groups.size().index.to_frame(index=False)
+    # Rows with a missing group key are numbered NaN
+    codes = groups.ngroup().fillna(-1).to_numpy(dtype=int)
+    rows = groups.cumcount().fillna(-1).to_numpy(dtype=int)
+    valid = codes >= 0
+
+    stacked = np.full((len(group_keys), rows.max(initial=-1) + 1, len(columns)), np.nan)
+    stacked[codes[valid], rows[valid]] = data[columns].to_numpy(dtype=float)[valid]
 
+    quantiles = _nanquantile(stacked, levels, axis=1)
+    quantiles[:, (~np.isnan(stacked)).sum(axis=1) < min_count] = np.nan
+
+    index = group_keys.loc[group_keys.index.repeat(len(columns))].reset_index(drop=True)
+    index['column'] = np.tile(columns, len(group_keys))
+    index = pd.MultiIndex.from_frame(index, names=[None] + ([by] if by else []) + [None])
+    return pd.DataFrame(quantiles.reshape(len(levels), -1).T, index=index,
+                        columns=[quantile_name(level) for level in levels])
+
+
+def rolling_quantiles(history: pd.DataFrame, window: int, levels: List[float] = quantile_levels) -> pd.DataFrame:
+    """
+    Quantiles over a trailing window of a history, pooling all constituents and dates of the window.
+
+    Args:
+        history (pd.DataFrame): One column (e.g. a return horizon) over time, dates as index and constituents as columns.
+        window (int): Number of dates in the window.
+        levels (List[float]): Quantile levels.
+
+    Returns:
+        pd.DataFrame: One row per date with a full window, one column per level.
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(history.to_numpy(dtype=float), window, axis=0)
+    quantiles = _nanquantile(windows.reshape(len(windows), -1), levels, axis=1)
+    return pd.DataFrame(quantiles.T, index=history.index[window - 1:], columns=[quantile_name(level) for level in levels])
 
-def filter_positions(positions: pd.DataFrame, sector: str = None) -> (pd.DataFrame, pd.DataFrame):
-    def get_quantiles(row):
-        if sector:
-            return us_quantiles if sector == 'US' else eu_quantiles
-        else:
-            return us_quantiles if row['Region'] == 'US' else eu_quantiles
-
-    positives = []
-    negatives = []
-
-    for _, row in positions.iterrows():
-        quantiles = get_quantiles(row)
-        if sector:
-            pos_condition = (
-                    ((row['1D vs. Sector'] > quantiles.loc['1D vs. Sector', '95th Quantile']) |
-                    (row['5D vs. Sector'] > quantiles.loc['5D vs. Sector', '95th Quantile']) |
-                    (row['1MO vs. Sector'] > quantiles.loc['1MO vs. Sector', '95th Quantile']) |
-                    (row['YTD vs. Sector'] > quantiles.loc['YTD vs. Sector', '95th Quantile'])) &
-                    ((row['1D'] > quantiles.loc['1D', '95th Quantile']) |
-                    (row['5D'] > quantiles.loc['5D', '95th Quantile']) |
-                    (row['1MO'] > quantiles.loc['1MO', '95th Quantile']) |
-                    (row['YTD'] > quantiles.loc['YTD', '95th Quantile']))
-            )
-            neg_condition = (
-                    ((row['1D vs. Sector'] < quantiles.loc['1D vs. Sector', '5th Quantile']) |
-                    (row['5D vs. Sector'] < quantiles.loc['5D vs. Sector', '5th Quantile']) |
-                    (row['1MO vs. Sector'] < quantiles.loc['1MO vs. Sector', '5th Quantile']) |
-                    (row['YTD vs. Sector'] < quantiles.loc['YTD vs. Sector', '5th Quantile'])) &
-                    ((row['1D'] < quantiles.loc['1D', '5th Quantile']) |
-                    (row['5D'] < quantiles.loc['5D', '5th Quantile']) |
-                    (row['1MO'] < quantiles.loc['1MO', '5th Quantile']) |
-                    (row['YTD'] < quantiles.loc['YTD', '5th Quantile']))
-            )
-        else:
-            pos_condition = (
-                    (row['1D vs. Sector'] > quantiles.loc['1D vs. Sector', '95th Quantile']) |
-                    (row['5D vs. Sector'] > quantiles.loc['5D vs. Sector', '95th Quantile']) |
-                    (row['1MO vs. Sector'] > quantiles.loc['1MO vs. Sector', '95th Quantile'])
-            )
-            neg_condition = (
-                    ((row['1D vs. Sector'] < quantiles.loc['1D vs. Sector', '5th Quantile']) |
-                    (row['5D vs. Sector'] < quantiles.loc['5D vs. Sector', '5th Quantile']) |
-                    (row['1MO vs. Sector'] < quantiles.loc['1MO vs. Sector', '5th Quantile']) |
-                    (row['YTD vs. Sector'] < quantiles.loc['YTD vs. Sector', '5th Quantile'])) |
-                    (row['% since AEQ'] < -5) #| (row['Δ 200D Mvag'] < -10) | (row['Δ 52 Week High'] < -15)
-            )
-
-        if pos_condition:
-            positives.append(row)
-        if neg_condition:
-            negatives.append(row)
-
-    positive_positions = pd.DataFrame(positives)
-    negative_positions = pd.DataFrame(negatives)
-
-    return positive_positions, negative_positions
-
-
-single_stocks = get_stocks_data()
-funds = get_funds_data()
-regions = get_regions_data()
-
-third_party_products = get_third_party_products()
-
-us_universe = get_universe_data(universe="S&P 500")
-us_sector = get_us_sector_data()
-
-eu_universe = get_universe_data(universe="STOXX Europe 600")
-eu_sector = get_eu_sector_data()
-
-us = calc_universe_rel_performance_vs_sector(universe=us_universe, sector=us_sector)
-eu = calc_universe_rel_performance_vs_sector(universe=eu_universe, sector=eu_sector)
 
 columns_to_analyze = ['1D', '5D', '1MO', 'YTD', '1D vs. Sector', '5D vs. Sector', '1MO vs. Sector', 'YTD vs. Sector']
 
-us_quantiles = calculate_quantiles(us, columns_to_analyze)
-eu_quantiles = calculate_quantiles(eu, columns_to_analyze)
 
+# Quantile table of a position's Region, every other region is screened with the EU thresholds
+region_mapping = {'US': 'US', 'EU': 'EU'}
+
+
+def broadcast_quantiles(frame: pd.DataFrame, quantile: str, sector: str = None, by_sector: bool = True) -> pd.DataFrame:
+    """
+    Broadcast the quantile thresholds onto the rows of frame. With by_sector, rows are joined on
+    (Region, Sector) with the per-sector quantiles, rows without a sector table fall back to their region's.
+
+    Args:
+        frame (pd.DataFrame): Positions or universe, needs a 'Region' column unless sector is given.
+        quantile (str): Column of the quantile tables, e.g. '5th Quantile'.
+        sector (str): 'US' or 'EU' to use one region's thresholds for every row.
+        by_sector (bool): Use the per-(Region, Sector) thresholds where the frame has a 'Sector' column.
+    """
+    if sector:
+        regions = pd.Index(['US' if sector == 'US' else 'EU'] * len(frame))
+    else:
+        regions = pd.Index(frame['Region'].astype(object).map(region_mapping).fillna('EU'))
+
+    thresholds = market_data.quantiles[quantile].unstack().reindex(regions)
+
+    if by_sector and 'Sector' in frame.columns:
+        sector_thresholds = market_data.sector_quantiles[quantile].unstack()
+        by_region_sector = sector_thresholds.reindex(pd.MultiIndex.from_arrays([regions, frame['Sector']]))
+        by_region_sector = by_region_sector[thresholds.columns].to_numpy(dtype=float)
+        thresholds = pd.DataFrame(np.where(np.isnan(by_region_sector), thresholds.to_numpy(dtype=float), by_region_sector),
+                                  columns=thresholds.columns)
+
+    thresholds.index = frame.index
+    return thresholds
+
+
+def evaluate_rules(frame: pd.DataFrame, sector: str = None, rule_set: str = None,
+                   by_sector: bool = True) -> (pd.Series, pd.Series):
+    """
+    Evaluate the positive and negative outlier rules of a rule set from screening_rules.json.
+    Defaults to the 'sector' rules if sector is given, otherwise to the 'positions' rules.
+    Returns two boolean masks aligned with frame.
+    """
+    rules = market_data.screening_rules[rule_set or ('sector' if sector else 'positions')]
+    masks = screen(frame, rules, lambda quantile: broadcast_quantiles(frame, quantile, sector, by_sector))
+    return masks['positive'], masks['negative']
+
+
+def screen_variants(frame: pd.DataFrame, sector: str = None, by_sector: bool = True) -> pd.DataFrame:
+    """
+    Evaluate every rule set of screening_rules.json in one pass over frame. Rule sets reading columns
+    the frame does not have, e.g. '% since AEQ' of the positions rules on a universe, are skipped.
+    Returns one boolean column per rule, named '<rule set> <positive|negative>'.
+    """
+    rules = {f"{name} {kind}": rule
+             for name, rule_set in market_data.screening_rules.items()
+             if all(rule.columns <= set(frame.columns) for rule in rule_set.values())
+             for kind, rule in rule_set.items()}
+    return screen(frame, rules, lambda quantile: broadcast_quantiles(frame, quantile, sector, by_sector))
+
+
+def filter_positions(positions: pd.DataFrame, sector: str = None, rule_set: str = None,
+                     by_sector: bool = True) -> (pd.DataFrame, pd.DataFrame):
+    pos_condition, neg_condition = evaluate_rules(positions, sector=sector, rule_set=rule_set, by_sector=by_sector)
+    return positions[pos_condition.to_numpy()], positions[neg_condition.to_numpy()]
+
+
+def screen_universe(sector: str) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Screen the full S&P 500 ('US') or STOXX Europe 600 ('EU') universe with the sector outlier rules.
+    """
+    universe = market_data.us if sector == 'US' else market_data.eu
+    return filter_positions(universe, sector=sector)
+
+
+return_columns = ['1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High']
+
+# Schemas of the frames held by market_data: (leading columns in this order, columns stored as categoricals,
+# columns stored as float32). float32 keeps about 7 significant digits, enough for the Bloomberg returns in %, but
+# a value within ~1e-6 of a screening threshold can round onto it. '% since AEQ' is a ratio of prices screened
+# against fixed cutoffs, it stays float64 like prices, volumes and market caps.
+frame_schemas = {
+    'positions': (['accountsegment_id', 'account_id', 'report_date', 'ISIN', 'Query', 'Sector', 'Region', 'Crncy',
+                   'Volume', 'AEQ', 'AEX', 'last_quote', 'Last Price', '% since AEQ'] + return_columns,
+                  ['accountsegment_id', 'account_id', 'Sector', 'Region', 'Crncy'],
+                  return_columns),
+    'universe': (['Query', 'Name', 'Sector'] + return_columns,
+                 ['Sector', 'Region', 'Country', 'Crncy'],
+                 return_columns),
+}
 
-us_metrics_positions = f"""
-   1D vs. Sector < <b>{us_quantiles.loc['1D vs. Sector', '5th Quantile']}%</b>, oder<br>
-   5D vs. Sector < <b>{us_quantiles.loc['5D vs. Sector', '5th Quantile']}%</b>, oder<br>
-   1MO vs. Sector < <b>{us_quantiles.loc['1MO vs. Sector', '5th Quantile']}%</b>, oder<br>
-   YTD vs. Sector < <b>{us_quantiles.loc['YTD vs. Sector', '5th Quantile']}%
-"""
+# Deep memory usage in bytes of every compacted frame, (before, after)
+frame_memory: Dict[str, Tuple[int, int]] = {}
+
+
+def compact(frame: pd.DataFrame, schema: str, name: str = None) -> pd.DataFrame:
+    """
+    Normalize a frame to its schema in frame_schemas: fixed column order, repeated strings as categoricals
+    and returns as float32. Columns missing from the frame are skipped, columns not in the schema follow
+    in their original order. Index levels already store every distinct value once and are kept.
+
+    Args:
+        frame (pd.DataFrame): Frame to normalize.
+        schema (str): Key of frame_schemas, e.g. 'positions'.
+        name (str): Label of the frame in frame_memory, defaults to schema.
+    """
+    order, categories, floats = frame_schemas[schema]
+    leading = [col for col in order if col in frame.columns]
+    df = frame[leading + [col for col in frame.columns if col not in leading]]
+
+    dtypes = {col: 'category' for col in categories if col in df.columns and df[col].dtype == object}
+    dtypes.update({col: np.float32 for col in floats if col in df.columns and df[col].dtype.kind in 'fiu'})
+    df = df.astype(dtypes)
+
+    before, after = int(frame.memory_usage(deep=True).sum()), int(df.memory_usage(deep=True).sum())
+    frame_memory[name or schema] = (before, after)
+    logger.info("%s: %.1f MB -> %.1f MB (%d rows)", name or schema, before / 2 ** 20, after / 2 ** 20, len(df))
+    return df
+
+
+def describe_thresholds(rule: Rule, quantiles: pd.DataFrame) -> str:
+    """
+    Threshold text of a positions rule for one region. Positions are screened with the per-sector quantiles
+    (see broadcast_quantiles), the region-wide values rendered here only apply where a sector has none.
+    """
+    return (f"{rule.describe(quantiles).rstrip()}<br>\n   (Quantile je Sektor, die Werte der Region gelten nur "
+            f"für Sektoren mit weniger als {sector_quantile_min_count} Titeln)\n")
+
+
+class shared_property:
+    """
+    functools.cached_property with a lock per attribute on every Python version. cached_property has no
+    lock since Python 3.12, so two report stages accessing an attribute at the same time would both load it.
+    """
+
+    def __init__(self, func: Callable):
+        self.func = func
+        self.lock = threading.Lock()
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if self.name not in instance.__dict__:
+            with self.lock:
+                if self.name not in instance.__dict__:
+                    instance.__dict__[self.name] = self.func(instance)
+        return instance.__dict__[self.name]
+
+
+class MarketData:
+    """
+    Lazily loaded data shared by the reports. Every attribute is loaded on first access only,
+    so a report pays just for the sheets and queries it actually uses.
+    """
+
+    @shared_property
+    def single_stocks(self) -> pd.DataFrame:
+        return get_stocks_data()
+
+    @shared_property
+    def funds(self) -> pd.DataFrame:
+        return get_funds_data()
+
+    @shared_property
+    def regions(self) -> pd.DataFrame:
+        return get_regions_data()
+
+    @shared_property
+    def third_party_products(self) -> pd.DataFrame:
+        return get_third_party_products()
+
+    @shared_property
+    def snapshot(self) -> PositionSnapshot:
+        return PositionSnapshot(report_date=REPLAY_DATE)
+
+    @shared_property
+    def positions(self) -> pd.DataFrame:
+        return compact(get_positions(), 'positions')
+
+    @shared_property
+    def account_futures(self) -> pd.DataFrame:
+        return get_account_futures()
+
+    @shared_property
+    def futures_data(self) -> pd.DataFrame:
+        return get_futures_data()
+
+    @shared_property
+    def us_universe(self) -> pd.DataFrame:
+        return compact(get_universe_data(universe="S&P 500"), 'universe', name='us_universe')
+
+    @shared_property
+    def eu_universe(self) -> pd.DataFrame:
+        return compact(get_universe_data(universe="STOXX Europe 600"), 'universe', name='eu_universe')
+
+    @shared_property
+    def us_sector(self) -> pd.DataFrame:
+        return get_us_sector_data()
+
+    @shared_property
+    def eu_sector(self) -> pd.DataFrame:
+        return get_eu_sector_data()
+
+    @shared_property
+    def index_composition(self) -> (pd.DataFrame, pd.Series):
+        return get_index_composition()
+
+    @shared_property
+    def us(self) -> pd.DataFrame:
+        return calc_universe_rel_performance_vs_sector(universe=self.us_universe, sector=self.us_sector)
+
+    @shared_property
+    def eu(self) -> pd.DataFrame:
+        return calc_universe_rel_performance_vs_sector(universe=self.eu_universe, sector=self.eu_sector)
+
+    @shared_property
+    def quantiles(self) -> pd.DataFrame:
+        return calculate_quantiles({'US': self.us, 'EU': self.eu}, columns_to_analyze)
+
+    @shared_property
+    def sector_quantiles(self) -> pd.DataFrame:
+        return calculate_quantiles({'US': self.us, 'EU': self.eu}, columns_to_analyze, by='Sector',
+                                   min_count=sector_quantile_min_count)
+
+    @shared_property
+    def us_quantiles(self) -> pd.DataFrame:
+        return self.quantiles.loc['US']
+
+    @shared_property
+    def eu_quantiles(self) -> pd.DataFrame:
+        return self.quantiles.loc['EU']
+
+    @shared_property
+    def screening_rules(self) -> dict:
+        return load_rules('screening_rules.json')
+
+    @shared_property
+    def us_metrics_positions(self) -> str:
+        return describe_thresholds(self.screening_rules['positions']['negative'], self.us_quantiles)
+
+    @shared_property
+    def eu_metrics_positions(self) -> str:
+        return describe_thresholds(self.screening_rules['positions']['negative'], self.eu_quantiles)
+
+
+market_data = MarketData()
+
+# History datasets by name: (attribute of market_data, indexed lookup key, schema in frame_schemas). The universes
+# have no ISIN, they are keyed by their Bloomberg query
+history_datasets = {
+    'us': ('us', 'Query', 'universe'),
+    'eu': ('eu', 'Query', 'universe'),
+    'us_sector': ('us_sector', None, None),
+    'eu_sector': ('eu_sector', None, None),
+    'regions': ('regions', 'Name', None),
+    'stocks': ('single_stocks', 'isin', None),
+    'funds': ('funds', 'bloomberg_query', None),
+    'positions': ('positions', 'ISIN', 'positions'),
+}
 
-eu_metrics_positions = f"""
-   1D vs. Sector < <b>{eu_quantiles.loc['1D vs. Sector', '5th Quantile']}%</b>, oder<br>
-   5D vs. Sector < <b>{eu_quantiles.loc['5D vs. Sector', '5th Quantile']}%</b>, oder<br>
-   1MO vs. Sector < <b>{eu_quantiles.loc['1MO vs. Sector', '5th Quantile']}%</b>, oder<br>
-   YTD vs. Sector < <b>{eu_quantiles.loc['YTD vs. Sector', '5th Quantile']}%
-"""
 
-print(us_metrics_positions)
-print(eu_metrics_positions)
+def record_history(datasets: Iterable[str] = tuple(history_datasets)):
+    """
+    Append today's normalized frames to the history store under the report date of the position snapshot.
+    Nothing is recorded when replaying a past report date, the workbook frames are today's and would
+    replace that date's history.
+    """
+    if REPLAY_DATE:
+        logger.info("Replaying %s, history is not recorded", REPLAY_DATE)
+        return
+    report_date = market_data.snapshot.report_date
+    for name in datasets:
+        attribute, key, schema = history_datasets[name]
+        types = history.column_types(*frame_schemas[schema][1:]) if schema else None
+        history.append(name, getattr(market_data, attribute), report_date, key=key, types=types)
+
+
+def _history_start(dataset: str, days: int) -> pd.Timestamp:
+    dates = history.report_dates(dataset)[-days:]
+    if len(dates) < days:
+        raise ValueError(f"History of {dataset} has {len(dates)} report dates, {days} are needed.")
+    return dates[0]
+
+
+def historical_quantiles(region: str, column: str, window: int, days: int = None,
+                         levels: List[float] = quantile_levels) -> pd.DataFrame:
+    """
+    Rolling quantiles of one column of a region's universe over the recorded history, see record_history.
+
+    Args:
+        region (str): 'US' or 'EU'.
+        column (str): Column of the universe, e.g. '1D vs. Sector'.
+        window (int): Number of report dates in the window.
+        days (int): Number of report dates read, defaults to one window.
+        levels (List[float]): Quantile levels.
+    """
+    dataset = region.lower()
+    start = _history_start(dataset, max(days or window, window))
+    return rolling_quantiles(history.panel(dataset, column, key=history_datasets[dataset][1], start=start),
+                             window, levels)
+
+
+def historical_drawdowns(dataset: str, days: int, values: Iterable[str] = None,
+                         column: str = 'Last Price') -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    """
+    Drawdowns over the last days report dates of a price column of the history, e.g. of the stocks
+    by ISIN or the funds by Bloomberg query. Returns the peaks, curves and stats of utility.drawdowns.
+
+    Args:
+        dataset (str): 'stocks', 'funds' or 'positions'.
+        days (int): Number of report dates.
+        values (Iterable[str]): Keys to read, all by default. Read through the key index of the dataset.
+        column (str): Price column.
+    """
+    key = history_datasets[dataset][1]
+    prices = history.panel(dataset, column, key=key, start=_history_start(dataset, days), values=values)
+    # The sheets fill missing prices with 0
+    return drawdowns(prices.where(prices > 0))
+
+
+def historical_rel_performance(region: str, days: int, values: Iterable[str] = None,
+                               horizon: str = '1D') -> pd.DataFrame:
+    """
+    Relative performance vs. sector of a region's universe over the last days report dates,
+    report dates x Bloomberg queries.
+
+    Args:
+        region (str): 'US' or 'EU'.
+        days (int): Number of report dates.
+        values (Iterable[str]): Bloomberg queries to read, all by default.
+        horizon (str): '1D', '5D', '1MO' or 'YTD'.
+    """
+    dataset = region.lower()
+    return history.panel(dataset, f'{horizon} vs. Sector', key=history_datasets[dataset][1],
+                         start=_history_start(dataset, days), values=values)
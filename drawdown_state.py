@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from utility import drawdowns
+
+DRAWDOWN_CACHE_DIR = os.path.join('.cache', 'drawdowns')
+
+
+def _checksum(prices: pd.DataFrame) -> str:
+    sha = hashlib.sha256()
+    sha.update(json.dumps([str(c) for c in prices.columns]).encode('utf-8'))
+    sha.update(prices.index.to_numpy(dtype='datetime64[ns]').tobytes())
+    sha.update(np.ascontiguousarray(prices.to_numpy(dtype=float)).tobytes())
+    return sha.hexdigest()
+
+
+def _initial_state(prices: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    peaks, curves, stats = drawdowns(prices)
+    state = pd.DataFrame({
+        'Peak': peaks.iloc[-1] if len(peaks) else np.nan,
+        'Peak Date': stats['Current Peak Date'],
+        'Max Drawdown': stats['Max Drawdown'],
+        'Trough Date': stats['Trough Date'],
+        'Current Drawdown': stats['Current Drawdown'],
+    }, index=prices.columns)
+    return curves, state
+
+
+def _fold(state: pd.DataFrame, new: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Fold new price rows into the drawdown state, O(new rows). Returns the curve rows of the new prices
+    and the updated state.
+    """
+    values = new.to_numpy(dtype=float)
+    n_rows, n_cols = values.shape
+    cols = np.arange(n_cols)
+    dates = new.index.to_numpy()
+    valid = ~np.isnan(values)
+
+    peaks = np.fmax.accumulate(np.vstack([state['Peak'].to_numpy(dtype=float), values]), axis=0)[1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        new_curves = (values - peaks) / peaks
+
+    is_peak = valid & (values >= peaks)
+    last_peak = n_rows - 1 - is_peak[::-1].argmax(axis=0)
+    peak_dates = np.where(is_peak.any(axis=0), dates[last_peak], state['Peak Date'].to_numpy())
+
+    masked = np.where(valid, new_curves, np.inf)
+    trough = masked.argmin(axis=0)
+    trough_value = masked[trough, cols]
+    max_drawdown = state['Max Drawdown'].to_numpy(dtype=float)
+    deeper = valid.any(axis=0) & ~(trough_value >= max_drawdown)
+
+    last_valid = n_rows - 1 - valid[::-1].argmax(axis=0)
+    current = np.where(valid.any(axis=0), new_curves[last_valid, cols], state['Current Drawdown'].to_numpy(dtype=float))
+
+    state = pd.DataFrame({
+        'Peak': peaks[-1],
+        'Peak Date': pd.DatetimeIndex(peak_dates),
+        'Max Drawdown': np.where(deeper, trough_value, max_drawdown),
+        'Trough Date': pd.DatetimeIndex(np.where(deeper, dates[trough], state['Trough Date'].to_numpy())),
+        'Current Drawdown': current,
+    }, index=state.index)
+
+    return pd.DataFrame(new_curves, index=new.index, columns=new.columns), state
+
+
+def _write_json(path: str, data: dict):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(data, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def update_drawdowns(prices: pd.DataFrame, cache_dir: str = DRAWDOWN_CACHE_DIR) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Drawdown curves and state per underlying, updated from the persisted state with the price rows newer
+    than the last run only. The new curve rows are appended as one parquet file per run. Everything is
+    recomputed if the underlyings changed, the number of stored rows differs or any stored row was
+    revised (checksum of all stored rows).
+
+    Args:
+        prices (pd.DataFrame): Prices, one column per underlying, sorted by date.
+        cache_dir (str): Directory of the persisted state.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): Drawdown curves, and per underlying the running Peak, Peak Date,
+        Max Drawdown, Trough Date and Current Drawdown.
+    """
+    meta_file = os.path.join(cache_dir, 'state.json')
+    curves_dir = os.path.join(cache_dir, 'curves')
+    state_file = os.path.join(cache_dir, 'state.parquet')
+
+    curves = state = None
+    try:
+        with open(meta_file, 'r') as file:
+            meta = json.load(file)
+        last_date = pd.Timestamp(meta['last_date'])
+        stored = prices.index.searchsorted(last_date, side='right')
+
+        if (meta['columns'] == [str(c) for c in prices.columns] and stored == meta['rows']
+                and _checksum(prices.iloc[:stored]) == meta['checksum']):
+            # Parts written by a run which crashed before its state.json are beyond last_date
+            parts = sorted(entry.path for entry in os.scandir(curves_dir) if entry.name.endswith('.parquet'))
+            curves = pd.concat([pd.read_parquet(part) for part in parts])
+            curves = curves.loc[curves.index <= last_date]
+            state = pd.read_parquet(state_file)
+            curves.columns = prices.columns
+            state.index = prices.columns
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if curves is None:
+        curves, state = _initial_state(prices)
+        new_curves = curves
+        shutil.rmtree(curves_dir, ignore_errors=True)
+    else:
+        new = prices.iloc[stored:]
+        if new.empty:
+            return curves, state
+        new_curves, state = _fold(state, new)
+        curves = pd.concat([curves, new_curves])
+
+    if prices.empty:
+        return curves, state
+
+    os.makedirs(curves_dir, exist_ok=True)
+    part = os.path.join(curves_dir, f"{new_curves.index[0]:%Y%m%d%H%M%S}.parquet")
+    new_curves.rename(columns=str).to_parquet(part + '.tmp')
+    os.replace(part + '.tmp', part)
+    state.rename(index=str).to_parquet(state_file + '.tmp')
+    os.replace(state_file + '.tmp', state_file)
+    _write_json(meta_file, {
+        'columns': [str(c) for c in prices.columns],
+        'last_date': str(prices.index[-1]),
+        'rows': len(prices),
+        'checksum': _checksum(prices)
+    })
+
+    return curves, state
@@ -2,26 +2,23 @@ import os
 
 from matplotlib.colors import LinearSegmentedColormap
 
-from data_provider import get_account_futures, get_futures_data
+from data_provider import market_data
+from drawdown_state import update_drawdowns
 from plot import plot_drawdown_chart
+from render import collect, export
 from utility import escape_latex, cleanup_aux_files, positions_overview, write_mail
-import dataframe_image as dfi
 from jinja2 import Template
 import subprocess
 from pdf2image import convert_from_path
 
 
-account_future_positions = get_account_futures()
-futures_data = get_futures_data()
-
-
 def generate_futures_report():
+    futures_data = market_data.futures_data
+    curves, _ = update_drawdowns(futures_data)
     futures = []
 
     for c in futures_data.columns:
-        data = futures_data[c]
-        data.dropna(inplace=True)
-        drawdown_chart = plot_drawdown_chart(data=data, underlying_name=c)
+        drawdown_chart = plot_drawdown_chart(drawdowns=curves[c].dropna(), underlying_name=c)
 
         futures.append({
             'name': escape_latex(c),
@@ -41,7 +38,7 @@ def generate_futures_report():
     page.save('output/futures/Futures_Drawdown_Overview.png', 'PNG')
     mail_data = {'drawdown': 'output/futures/Futures_Drawdown_Overview.png'}
 
-    all_positions = positions_overview(data=futures_data, positions=account_future_positions)
+    all_positions = positions_overview(data=futures_data, positions=market_data.account_futures)
 
     if not all_positions.empty:
         max_abs_value_aeq = max(abs(all_positions['% since AEQ'].min().min()),
@@ -63,12 +60,11 @@ def generate_futures_report():
                                     'Exposure': "{:.2f}%"
                                 }).hide(axis="index"))
 
-        dfi.export(styled_all_positions, 'output/futures/Positions_Overview.png', table_conversion="selenium")
-        mail_data.update({'futures': 'output/futures/Positions_Overview.png'})
+        mail_data.update({'futures': export(styled_all_positions, 'output/futures/Positions_Overview.png')})
 
     cleanup_aux_files()
 
-    return mail_data
+    return collect(mail_data)
 
 
 if __name__ == '__main__':
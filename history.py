@@ -0,0 +1,231 @@
+import os
+import shutil
+from typing import Dict, Iterable, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+HISTORY_DIR = os.environ.get('REPORT_HISTORY', 'history')
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# Arrow schema of a dataset, fixed by its first date and only ever extended by new columns
+_SCHEMA_FILE = '_common_metadata'
+_PARTITION = pa.field('report_date', pa.date32())
+_PARTITIONING = ds.partitioning(pa.schema([_PARTITION]), flavor='hive')
+
+# Rows per row group of a key index, the index is sorted by key so lookups read only a few row groups
+INDEX_ROW_GROUP_SIZE = 20_000
+
+
+def column_types(categories: Iterable[str] = (), float32: Iterable[str] = ()) -> Dict[str, pa.DataType]:
+    """
+    Arrow types of the columns a frame schema declares, e.g. of data_provider.frame_schemas.
+    """
+    return {**{col: CATEGORY for col in categories}, **{col: pa.float32() for col in float32}}
+
+
+def _arrow_type(series: pd.Series) -> pa.DataType:
+    """
+    Type of an undeclared column. Everything which is not numeric, boolean or a timestamp is stored as string,
+    so an object column holding numbers on one day and text on another keeps its type. Numbers mixed with
+    Bloomberg error strings ('#N/A Invalid Security', ...) only are float64, the errors are stored as null.
+    """
+    dtype = series.dtype
+    if dtype == object:
+        strings = series.map(lambda v: isinstance(v, str))
+        numbers = series[~strings]
+        if (strings.any() and series[strings].str.startswith('#N/A').all() and numbers.notna().any()
+                and numbers.map(lambda v: isinstance(v, (int, float))).all()):
+            return pa.float64()
+    if isinstance(dtype, pd.CategoricalDtype):
+        return CATEGORY
+    if dtype.kind == 'M':
+        return pa.timestamp('ns')
+    if dtype.kind == 'b':
+        return pa.bool_()
+    if dtype.kind in 'iuf':
+        return pa.float32() if dtype == 'float32' else pa.float64()
+    return pa.string()
+
+
+def _column(series: pd.Series, type: pa.DataType) -> pa.Array:
+    if pa.types.is_floating(type):
+        return pa.array(pd.to_numeric(series, errors='coerce').astype(float), type=type, from_pandas=True)
+    if pa.types.is_timestamp(type):
+        return pa.array(pd.to_datetime(series, errors='coerce'), type=type, from_pandas=True)
+    if pa.types.is_string(type) or pa.types.is_dictionary(type):
+        values = series.astype(object)
+        values = values.where(values.notna(), None).map(lambda v: v if v is None else str(v))
+        array = pa.array(values, type=pa.string(), from_pandas=True)
+        return array.dictionary_encode() if pa.types.is_dictionary(type) else array
+    return pa.array(series, from_pandas=True).cast(type)
+
+
+def schema(dataset: str, directory: str = HISTORY_DIR) -> pa.Schema:
+    """
+    Arrow schema of a dataset without its report_date partition column, None if nothing was stored yet.
+    """
+    path = os.path.join(directory, dataset, _SCHEMA_FILE)
+    return pq.read_schema(path) if os.path.exists(path) else None
+
+
+def _extend_schema(dataset: str, directory: str, df: pd.DataFrame, types: Dict[str, pa.DataType]) -> pa.Schema:
+    path = os.path.join(directory, dataset)
+    stored = schema(dataset, directory)
+    fields = list(stored or [])
+    known = {field.name for field in fields}
+    fields += [pa.field(col, types.get(col) or _arrow_type(df[col])) for col in df.columns if col not in known]
+
+    extended = pa.schema(fields)
+    if stored is None or not extended.equals(stored):
+        os.makedirs(path, exist_ok=True)
+        pq.write_metadata(extended, os.path.join(path, _SCHEMA_FILE + '.tmp'))
+        os.replace(os.path.join(path, _SCHEMA_FILE + '.tmp'), os.path.join(path, _SCHEMA_FILE))
+    return extended
+
+
+def _partition(path: str, report_date: pd.Timestamp) -> str:
+    return os.path.join(path, f"report_date={report_date:%Y-%m-%d}")
+
+
+def _index_file(path: str, key: str) -> str:
+    return os.path.join(path, f"_index_{key}.parquet")
+
+
+def _update_index(path: str, key: str, values: pd.Series, report_date: pd.Timestamp):
+    """
+    Maintain the key index of a dataset, one row per key and report date it occurs on, sorted by key.
+    """
+    file = _index_file(path, key)
+    keys = pd.DataFrame({'key': pd.Series(values.dropna().astype(str).unique(), dtype=object),
+                         'report_date': report_date.date()})
+    if os.path.exists(file):
+        stored = pd.read_parquet(file)
+        keys = pd.concat([stored[stored['report_date'] != report_date.date()], keys], ignore_index=True)
+
+    table = pa.Table.from_pandas(keys.sort_values(['key', 'report_date'], kind='stable'), preserve_index=False,
+                                 schema=pa.schema([pa.field('key', pa.string()), _PARTITION]))
+    pq.write_table(table, file + '.tmp', row_group_size=INDEX_ROW_GROUP_SIZE, compression='zstd')
+    os.replace(file + '.tmp', file)
+
+
+def append(dataset: str, frame: pd.DataFrame, report_date, key: str = None, types: Dict[str, pa.DataType] = None,
+           directory: str = HISTORY_DIR):
+    """
+    Store the frame of one report date in the history. Dates are only ever added, writing a date
+    again replaces that date's partition. Every date is written with the schema of the dataset.
+
+    Args:
+        dataset (str): Name of the series, e.g. 'us' or 'positions'.
+        frame (pd.DataFrame): Normalized frame, the index is stored as columns.
+        report_date: Report date of the frame.
+        key (str): Column lookups filter on, e.g. 'ISIN'. It is indexed by report date.
+        types (Dict[str, pa.DataType]): Arrow types of columns new to the dataset, see column_types.
+        directory (str): Root of the history store.
+    """
+    report_date = pd.Timestamp(report_date).normalize()
+    df = frame.reset_index() if any(name is not None for name in frame.index.names) else frame.reset_index(drop=True)
+    df = df.drop(columns='report_date', errors='ignore')
+    if key:
+        df = df.sort_values(key, kind='stable')
+
+    path = os.path.join(directory, dataset)
+    dataset_schema = _extend_schema(dataset, directory, df, types or {})
+    table = pa.Table.from_arrays([_column(df[field.name], field.type) if field.name in df.columns
+                                  else pa.nulls(len(df), field.type) for field in dataset_schema],
+                                 schema=dataset_schema)
+
+    # Files starting with '_' are not part of the dataset, a crash leaves no half written partition
+    partition = _partition(path, report_date)
+    tmp = os.path.join(path, '_' + os.path.basename(partition))
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    pq.write_table(table, os.path.join(tmp, 'part-0.parquet'), compression='zstd')
+
+    shutil.rmtree(partition, ignore_errors=True)
+    os.replace(tmp, partition)
+
+    if key:
+        _update_index(path, key, df[key], report_date)
+
+
+def report_dates(dataset: str, directory: str = HISTORY_DIR) -> List[pd.Timestamp]:
+    """
+    Report dates stored for a dataset, oldest first.
+    """
+    path = os.path.join(directory, dataset)
+    if not os.path.isdir(path):
+        return []
+    return sorted(pd.Timestamp(entry.name.split('=', 1)[1]) for entry in os.scandir(path)
+                  if entry.is_dir() and entry.name.startswith('report_date='))
+
+
+def key_dates(dataset: str, key: str, values: Iterable, directory: str = HISTORY_DIR) -> List[pd.Timestamp]:
+    """
+    Report dates on which any of the values of key occurs, from the key index of the dataset.
+    """
+    file = _index_file(os.path.join(directory, dataset), key)
+    index = pq.read_table(file, columns=['report_date'],
+                          filters=[('key', 'in', [str(value) for value in values])])
+    return sorted(pd.Timestamp(date) for date in set(index.column('report_date').to_pylist()))
+
+
+def read(dataset: str, start=None, end=None, columns: List[str] = None, key: str = None,
+         values: Iterable = None, directory: str = HISTORY_DIR) -> pd.DataFrame:
+    """
+    Read a date range of the history. The date range prunes partitions. A lookup of values of an indexed key
+    only opens the partitions the key index lists for them.
+
+    Args:
+        dataset (str): Name of the series.
+        start: First report date, inclusive.
+        end: Last report date, inclusive.
+        columns (List[str]): Columns to read, all by default. report_date is always included.
+        key (str): Column to filter on, e.g. 'ISIN' or 'Query'.
+        values (Iterable): Values of key to keep.
+        directory (str): Root of the history store.
+    """
+    path = os.path.join(directory, dataset)
+    stored = schema(dataset, directory)
+    if columns is not None:
+        columns = ['report_date'] + [col for col in columns if col != 'report_date']
+    if stored is None:
+        return pd.DataFrame(columns=columns or ['report_date'])
+
+    full_schema = stored.append(_PARTITION)
+    dates = report_dates(dataset, directory)
+    if key is not None and values is not None:
+        values = list(values)
+        if os.path.exists(_index_file(path, key)):
+            dates = key_dates(dataset, key, values, directory)
+    dates = [date for date in dates if (start is None or date >= pd.Timestamp(start))
+             and (end is None or date <= pd.Timestamp(end))]
+
+    files = [os.path.join(_partition(path, date), 'part-0.parquet') for date in dates]
+    data = ds.dataset(files, schema=full_schema, format='parquet', partitioning=_PARTITIONING,
+                      partition_base_dir=path)
+
+    condition = None
+    if key is not None and values is not None:
+        condition = ds.field(key).isin(pa.array([str(value) for value in values])
+                                       if pa.types.is_string(stored.field(key).type)
+                                       or pa.types.is_dictionary(stored.field(key).type) else values)
+
+    df = data.to_table(columns=columns, filter=condition).to_pandas()
+    df['report_date'] = pd.to_datetime(df['report_date'])
+    return df.sort_values('report_date', kind='stable').reset_index(drop=True)
+
+
+def panel(dataset: str, column: str, key: str, start=None, end=None, values: Iterable = None,
+          directory: str = HISTORY_DIR) -> pd.DataFrame:
+    """
+    One column of the history as report dates x keys, e.g. panel('us', '1D vs. Sector', key='Query')
+    for rolling_quantiles, or panel('stocks', 'Last Price', key='isin') for drawdowns.
+    """
+    df = read(dataset, start=start, end=end, columns=[key, column], key=key if values is not None else None,
+              values=values, directory=directory)
+    df[key] = df[key].astype(object)
+    return df.pivot_table(index='report_date', columns=key, values=column, aggfunc='last')
@@ -1,10 +1,13 @@
 import locale
+import logging
 import os
 
 from bm import generate_allocation_report
+from data_provider import market_data, record_history
 from futures import generate_futures_report
 from positioning import generate_positioning_report
 from risk import generate_risk_report
+from tasks import TaskGraph
 from third_party import generate_third_party_report
 from utility import write_mail
 
@@ -13,15 +16,36 @@ output_dir = "output"
 os.makedirs(os.path.join(output_dir, "images"), exist_ok=True)
 
 
-if __name__ == '__main__':
-    positioning_mail_data = generate_positioning_report()
-    futures_mail_data = generate_futures_report()
-    risk_mail_data = generate_risk_report()
-    third_party_mail_data = generate_third_party_report()
-    allocation_mail_data = generate_allocation_report()
+def load(attribute: str):
+    return lambda: getattr(market_data, attribute)
+
 
-    write_mail(positioning_mail_data, futures_mail_data, risk_mail_data, third_party_mail_data, allocation_mail_data)
+def daily_briefing() -> TaskGraph:
+    graph = TaskGraph()
 
+    # Shared data, every item is loaded once by the first stage needing it
+    graph.add('snapshot', load('snapshot'))
+    for attribute in ['us_sector', 'eu_sector', 'regions', 'futures_data', 'screening_rules']:
+        graph.add(attribute, load(attribute))
+    for attribute in ['positions', 'account_futures', 'third_party_products']:
+        graph.add(attribute, load(attribute), after=['snapshot'])
+    graph.add('quantiles', load('quantiles'), after=['us_sector', 'eu_sector'])
+    graph.add('sector_quantiles', load('sector_quantiles'), after=['us_sector', 'eu_sector'])
 
+    graph.add('positioning', generate_positioning_report, after=['us_sector', 'eu_sector', 'regions'])
+    graph.add('futures', generate_futures_report, after=['futures_data', 'account_futures'])
+    graph.add('risk', generate_risk_report,
+              after=['positions', 'us_sector', 'eu_sector', 'quantiles', 'sector_quantiles',
+                     'screening_rules'])
+    graph.add('third_party', generate_third_party_report, after=['third_party_products'])
+    graph.add('allocation', generate_allocation_report, after=['snapshot'])
 
+    graph.add('history', record_history, after=['snapshot', 'us_sector', 'eu_sector', 'regions', 'positions'])
+    return graph
 
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    results = daily_briefing().run()
+    # Outlook is driven through COM, which is only initialized on the main thread
+    write_mail(*(results[stage] for stage in ['positioning', 'futures', 'risk', 'third_party', 'allocation']))
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import pandas as pd
+
+OPUS_POOL_SIZE = int(os.environ.get('OPUS_POOL_SIZE', 4))
+
+
+class QueryPool:
+    """
+    Pool of warehouse connections shared by all reports. Every query runs on a connection of its own,
+    so queries submitted from different report stages run concurrently, and the connections are kept
+    open for the rest of the run.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = OPUS_POOL_SIZE):
+        """
+        Args:
+            factory (Callable): Opens a connection, e.g. OpusSource. Connections must provide read_sql(query=...).
+            size (int): Maximum number of open connections and concurrent queries.
+        """
+        self._factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='opus')
+        self._lock = threading.Lock()
+        self.latencies: List[Tuple[str, float]] = []
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._factory()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def read_sql(self, query: str, name: str = None) -> pd.DataFrame:
+        """
+        Run query on a pooled connection and record its latency.
+
+        Args:
+            query (str): SQL query.
+            name (str): Label of the query in latencies, defaults to a fingerprint of the query.
+        """
+        name = name or hashlib.sha256(' '.join(query.split()).encode('utf-8')).hexdigest()[:12]
+        connection = self._acquire()
+        start = time.perf_counter()
+        try:
+            df = connection.read_sql(query=query)
+        except BaseException:
+            # The connection may be broken, the next query opens a new one
+            connection = None
+            raise
+        finally:
+            with self._lock:
+                self.latencies.append((name, time.perf_counter() - start))
+            if connection is not None:
+                self._idle.put(connection)
+            self._slots.release()
+        return df
+
+    def submit(self, query: str, name: str = None) -> Future:
+        """
+        Run query in the background, returns a Future of the DataFrame.
+        """
+        return self._executor.submit(self.read_sql, query, name)
+
+    def stream(self, queries: Dict[str, str]) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """
+        Run independent queries concurrently and yield (name, DataFrame) in the order they finish.
+
+        Args:
+            queries (Dict[str, str]): SQL queries by name.
+        """
+        futures = {self.submit(query, name): name for name, query in queries.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
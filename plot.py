@@ -1,3 +1,4 @@
+from concurrent.futures import Future
 from typing import List
 
 import pandas as pd
@@ -5,19 +6,16 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as dates
 import matplotlib.ticker as ticker
 from matplotlib.colors import LinearSegmentedColormap
-import dataframe_image as dfi
 
-from utility import drawdown
+from render import export
 
 drawdown_color = '#E91457'
 
 
-def plot_drawdown_chart(data: pd.Series, underlying_name: str):
+def plot_drawdown_chart(drawdowns: pd.Series, underlying_name: str):
     fig, ax = plt.subplots(figsize=(10, 2))
 
-    dd = drawdown(data)
-
-    ax.plot(data.index, dd['Drawdowns'] * 100, label='Drawdown', color=drawdown_color, linestyle='-', linewidth=1.5)
+    ax.plot(drawdowns.index, drawdowns * 100, label='Drawdown', color=drawdown_color, linestyle='-', linewidth=1.5)
 
     ax.set_xlabel('Date')
     ax.set_ylabel('%')
@@ -31,8 +29,8 @@ def plot_drawdown_chart(data: pd.Series, underlying_name: str):
     ax.yaxis.set_minor_locator(ticker.AutoMinorLocator())
     ax.axhline(0, color='grey', linestyle='--', linewidth=0.5)
 
-    current_drawdown = dd['Drawdowns'].iloc[-1] * 100
-    ax.text(data.index[-1], current_drawdown, f'{current_drawdown:.2f}%', color=drawdown_color, fontsize=9,
+    current_drawdown = drawdowns.iloc[-1] * 100
+    ax.text(drawdowns.index[-1], current_drawdown, f'{current_drawdown:.2f}%', color=drawdown_color, fontsize=9,
             verticalalignment='top')
 
     filename = f"output/futures/{underlying_name}_drawdown.png"
@@ -42,7 +40,7 @@ def plot_drawdown_chart(data: pd.Series, underlying_name: str):
     return filename
 
 
-def style_positions_with_bars(positions: pd.DataFrame, name: str) -> str:
+def style_positions_with_bars(positions: pd.DataFrame, name: str) -> Future:
     columns_to_show = ['Sector', 'AEQ', 'Volume', 'Last Price', '% since AEQ', '1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag',
                        'Δ 52 Week High',
                        '1D vs. Sector', '5D vs. Sector', '1MO vs. Sector', 'YTD vs. Sector']
@@ -126,11 +124,10 @@ def style_positions_with_bars(positions: pd.DataFrame, name: str) -> str:
     }))
 
     output_path = f"output/risk/{name.replace(' ', '_').replace('&', '')}_Details.png"
-    dfi.export(styled, output_path, table_conversion="selenium")
-    return output_path
+    return export(styled, output_path)
 
 
-def style_index_with_bars(index: pd.DataFrame, name: str, hide_index: bool = False, borders: List = None) -> str:
+def style_index_with_bars(index: pd.DataFrame, name: str, hide_index: bool = False, borders: List = None) -> Future:
     table_style = []
     for border in borders:
         if isinstance(border, int):
@@ -147,6 +144,8 @@ def style_index_with_bars(index: pd.DataFrame, name: str, hide_index: bool = Fal
                      'props': [('border-top', '1px solid black')]}
                 )
 
+    # The sector and region frames are shared with stages running concurrently, never convert them in place
+    index = index.copy()
     for col in ['1D', '5D', '1MO', 'YTD', 'Δ 200D Mvag', 'Δ 52 Week High']:
         index[col] = pd.to_numeric(index[col], errors='coerce')
 
@@ -179,11 +178,10 @@ def style_index_with_bars(index: pd.DataFrame, name: str, hide_index: bool = Fal
         styled = styled.hide(axis="index")
 
     output_path = f"output/{name.replace(' ', '_')}_Details.png"
-    dfi.export(styled, output_path, table_conversion="selenium")
-    return output_path
+    return export(styled, output_path)
 
 
-def style_third_party(positions: pd.DataFrame, name: str) -> str:
+def style_third_party(positions: pd.DataFrame, name: str) -> Future:
     positions = positions.apply(pd.to_numeric, errors='coerce')
     aeq_max_abs_value = positions['% since AEQ'].abs().max()
     trr1d_max_abs_value = positions['1D'].abs().max()
@@ -233,5 +231,4 @@ def style_third_party(positions: pd.DataFrame, name: str) -> str:
         'Δ 200D Mvag': "{:.2f}%",
         'Δ 52 Week High': "{:.2f}%"
     }))
-    dfi.export(styled, output_path, table_conversion="selenium")
-    return output_path
+    return export(styled, output_path)
@@ -1,9 +1,13 @@
-from data_provider import us_sector, eu_sector, regions
+from data_provider import market_data
 from plot import style_index_with_bars
+from render import collect
 from utility import calc_sector_diff
 
 
 def generate_positioning_report():
+    us_sector = market_data.us_sector
+    eu_sector = market_data.eu_sector
+    regions = market_data.regions
 
     diff = calc_sector_diff(us=us_sector, eu=eu_sector)
     us_sector_chart = style_index_with_bars(index=us_sector, name='US', hide_index=False, borders=[0, 4, "last"])
@@ -11,9 +15,9 @@ def generate_positioning_report():
     diff_sector_chart = style_index_with_bars(index=diff, name='EU_vs_US', hide_index=False, borders=[0, 4, "last"])
     regions_chart = style_index_with_bars(index=regions, name='Regions', hide_index=False, borders=[0, 4])
 
-    return {
+    return collect({
         'Regionen': regions_chart,
         'EU': eu_sector_chart,
         'US': us_sector_chart,
         'EU vs. US': diff_sector_chart,
-    }
\ No newline at end of file
+    })
\ No newline at end of file
@@ -0,0 +1,231 @@
+import atexit
+import copy
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, Union
+
+import dataframe_image
+from dataframe_image._pandas_accessor import MAX_COLS, MAX_ROWS
+from dataframe_image.converter.browser.selenium_converter import SeleniumConverter
+from dataframe_image.pd_html import styler2html
+from pandas.io.formats.style import Styler
+from PIL import Image
+
+import table_renderer
+
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+
+# 'selenium' renders the Styler HTML in a headless browser, 'pillow' draws the table without a browser
+RENDERER = os.environ.get('REPORT_RENDERER', 'selenium')
+RENDERER_VERSIONS = {
+    'selenium': f"selenium-firefox/dataframe_image-{dataframe_image.__version__}/1",
+    'pillow': table_renderer.RENDERER_VERSION,
+}
+
+RENDER_CACHE_DIR = os.path.join('.cache', 'render')
+RENDER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RENDER_CACHE_MAX_AGE = 14 * 24 * 3600
+
+
+class _WarmSeleniumConverter(SeleniumConverter):
+    """
+    Same as dataframe_image's selenium converter, but screenshots with an already running browser
+    instead of starting a new headless Firefox for every table.
+    """
+
+    def __init__(self, driver, temp_dir: str, **kwargs):
+        super().__init__(**kwargs)
+        self.driver = driver
+        self.temp_dir = temp_dir
+
+    def screenshot(self, html: str) -> Image:
+        temp_html = Path(self.temp_dir) / "table.html"
+        temp_img = Path(self.temp_dir) / "table.png"
+        with open(temp_html, "w", encoding="utf-8") as f:
+            f.write(self.get_css() + html)
+
+        self.driver.get(temp_html.as_uri())
+        required_width = self.driver.execute_script("return document.querySelector('#dfi_table table').scrollWidth")
+        required_height = self.driver.execute_script("return document.querySelector('#dfi_table table').scrollHeight")
+        self.driver.set_window_size(required_width + 150, required_height + 90)
+        self.driver.save_screenshot(str(temp_img))
+
+        img = Image.open(temp_img)
+        img.load()
+        return img
+
+
+class RenderPool:
+    """
+    Pool of render workers, each keeping its own headless browser warm for the lifetime of the pool.
+    Styled tables are rendered to PNG concurrently, submit returns a Future of the output path.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, fontsize: int = 14, cache_dir: str = RENDER_CACHE_DIR):
+        self.fontsize = fontsize
+        self.cache_dir = cache_dir
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._local = threading.local()
+        self._browsers = []
+        self._lock = threading.Lock()
+
+    def _browser(self):
+        if not hasattr(self._local, "driver"):
+            import selenium.webdriver
+            from selenium.webdriver.firefox.service import Service
+
+            temp_dir = TemporaryDirectory(prefix="dataframe_image_")
+            options = selenium.webdriver.FirefoxOptions()
+            options.add_argument("--headless")
+            profile = selenium.webdriver.FirefoxProfile(temp_dir.name)
+            profile.set_preference("layout.css.devPixelsPerPx", "1")
+            options.profile = profile
+            service = Service(log_path=str(Path(temp_dir.name) / "geckodriver.log"))
+
+            self._local.driver = selenium.webdriver.Firefox(options=options, service=service)
+            self._local.temp_dir = temp_dir
+            with self._lock:
+                self._browsers.append((self._local.driver, temp_dir))
+
+        return self._local.driver, self._local.temp_dir.name
+
+    def _render(self, html: str, path: str, cached: str) -> str:
+        driver, temp_dir = self._browser()
+        converter = _WarmSeleniumConverter(driver=driver, temp_dir=temp_dir, fontsize=self.fontsize,
+                                           encode_base64=False)
+        image = converter.run(html)
+        with open(path, "wb") as f:
+            f.write(image)
+
+        self._store(path, cached)
+        return path
+
+    def _store(self, path: str, cached: str):
+        if cached:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            shutil.copyfile(path, cached + ".tmp")
+            os.replace(cached + ".tmp", cached)
+
+    def _cache_file(self, html: str, renderer: str) -> str:
+        key = hashlib.sha256(f"{RENDERER_VERSIONS[renderer]}|{self.fontsize}|{html}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def submit(self, styled: Styler, path: str, renderer: str = None) -> Future:
+        """
+        Render styled to path. The image is taken from the render cache if a table with the same values,
+        styling and renderer version was rendered before.
+
+        Args:
+            styled (Styler): Styled table.
+            path (str): Output path of the PNG.
+            renderer (str): 'selenium' or 'pillow', defaults to RENDERER.
+        """
+        renderer = renderer or RENDERER
+        if renderer not in RENDERER_VERSIONS:
+            raise ValueError(f"Unsupported renderer: {renderer}")
+
+        # Same guard as dataframe_image.export, a huge table would block a warm browser for minutes
+        rows, cols = styled.data.shape
+        if rows > MAX_ROWS or cols > MAX_COLS:
+            raise ValueError(f"Table for {path} has {rows} rows and {cols} columns, "
+                             f"at most {MAX_ROWS} rows and {MAX_COLS} columns are rendered.")
+
+        # A fixed uuid, set on a copy to leave the caller's Styler alone, makes the HTML, and so the cache key,
+        # depend on values and styling only. The Styler is rendered to HTML in the calling thread,
+        # workers only see plain strings
+        html = f'<div id="dfi_table">{styler2html(copy.copy(styled).set_uuid("dfi"))}</div>'
+
+        cached = self._cache_file(html, renderer) if self.cache_dir else None
+        if cached and os.path.exists(cached):
+            os.utime(cached)
+            shutil.copyfile(cached, path)
+            future = Future()
+            future.set_result(path)
+            return future
+
+        if renderer == 'pillow':
+            # Takes milliseconds, drawn right away in the calling thread
+            future = Future()
+            future.set_result(table_renderer.render_table(styled, path, fontsize=self.fontsize))
+            self._store(path, cached)
+            return future
+
+        return self._executor.submit(self._render, html, path, cached)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for driver, temp_dir in self._browsers:
+                driver.quit()
+                temp_dir.cleanup()
+            self._browsers.clear()
+
+
+def evict_render_cache(cache_dir: str = RENDER_CACHE_DIR, max_bytes: int = RENDER_CACHE_MAX_BYTES,
+                       max_age: float = RENDER_CACHE_MAX_AGE):
+    """
+    Remove cached images not used within max_age seconds, then the least recently used ones
+    until the cache is smaller than max_bytes.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    now = time.time()
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".png"):
+            continue
+        stat = entry.stat()
+        if now - stat.st_mtime > max_age:
+            os.remove(entry.path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> RenderPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            evict_render_cache()
+            _pool = RenderPool()
+            atexit.register(_pool.shutdown)
+    return _pool
+
+
+def export(styled: Styler, path: str, renderer: str = None) -> Future:
+    """
+    Render a styled DataFrame to a PNG at path in the shared render pool.
+
+    Args:
+        styled (Styler): Styled table.
+        path (str): Output path of the PNG.
+        renderer (str): 'selenium' or 'pillow', defaults to RENDERER (env REPORT_RENDERER).
+
+    Returns:
+        Future: Resolves to path once the image is written.
+    """
+    return get_render_pool().submit(styled, path, renderer=renderer)
+
+
+def collect(mail_data: Dict[str, Union[str, Future]]) -> Dict[str, str]:
+    """
+    Wait for all pending renders of a report and return its mail data with plain paths.
+    """
+    return {key: value.result() if isinstance(value, Future) else value for key, value in mail_data.items()}
@@ -1,13 +1,13 @@
-from data_provider import get_positions, us_sector, eu_sector, filter_positions
+from data_provider import market_data, filter_positions
 from plot import style_positions_with_bars
+from render import collect
 from utility import calc_position_rel_performance_vs_sector
 
 
 def generate_risk_report():
     risk = {}
 
-    positions = get_positions()
-    positions = calc_position_rel_performance_vs_sector(positions=positions, eu=eu_sector, us=us_sector)
+    positions = calc_position_rel_performance_vs_sector(positions=market_data.positions, eu=market_data.eu_sector, us=market_data.us_sector)
 
     unique_names = positions.index.get_level_values(0).unique()
 
@@ -20,4 +20,4 @@ def generate_risk_report():
                                                                  name=f'{name}_underperformed')
         risk.update({name: underperformed_details_chart})
 
-    return risk
+    return collect(risk)
@@ -0,0 +1,229 @@
+import json
+import operator
+import re
+from functools import lru_cache
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+HORIZONS = ['1D', '5D', '1MO', 'YTD']
+
+_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+_COMPARISON = re.compile(r'^(?P<column>[^<>]+?)\s*(?P<op><=|>=|<|>)\s*(?P<value>-?\d+(?:\.\d+)?|q\d+)$')
+_RANGE = re.compile(r'^(?P<start>\S+)\.\.(?P<end>\S+)(?P<suffix>.*)$')
+_QUANTIFIER = re.compile(r'^(?P<quantifier>any|all)\s*\(')
+
+
+def quantile_name(level: float) -> str:
+    """
+    Column of the quantile tables for a quantile level, e.g. 0.05 -> '5th Quantile', 0.01 -> '1st Quantile'.
+    """
+    percent = int(round(level * 100))
+    suffix = 'th' if 10 <= percent % 100 <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(percent % 10, 'th')
+    return f"{percent}{suffix} Quantile"
+
+
+def quantile_label(value: str) -> str:
+    """
+    Map a quantile reference of the rule language (q01, q05, q95, ...) to the column of the quantile tables.
+    """
+    return quantile_name(int(value[1:]) / 100)
+
+
+def _split(text: str, separator: str) -> list:
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _closes_at_end(text: str, start: int) -> bool:
+    depth = 0
+    for i, char in enumerate(text[start:], start):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return i == len(text) - 1
+    return False
+
+
+def _comparisons(text: str, rule: str) -> list:
+    match = _COMPARISON.match(text.strip())
+    if not match:
+        raise ValueError(f"Cannot parse comparison '{text.strip()}' in screening rule '{rule}'.")
+
+    column, op, value = match.group('column'), match.group('op'), match.group('value')
+    value = value if value.startswith('q') else float(value)
+
+    horizons = _RANGE.match(column)
+    if not horizons:
+        return [('cmp', column, op, value)]
+
+    start, end = horizons.group('start'), horizons.group('end')
+    if start not in HORIZONS or end not in HORIZONS:
+        raise ValueError(f"Unknown horizon range '{start}..{end}' in screening rule '{rule}'.")
+
+    return [('cmp', f"{horizon}{horizons.group('suffix')}", op, value)
+            for horizon in HORIZONS[HORIZONS.index(start):HORIZONS.index(end) + 1]]
+
+
+def _parse(text: str, rule: str) -> tuple:
+    text = text.strip()
+
+    for separator, kind in (('|', 'or'), ('&', 'and')):
+        parts = _split(text, separator)
+        if len(parts) > 1:
+            return kind, [_parse(part, rule) for part in parts]
+
+    if text.startswith('(') and _closes_at_end(text, 0):
+        return _parse(text[1:-1], rule)
+
+    quantifier = _QUANTIFIER.match(text)
+    if quantifier and _closes_at_end(text, quantifier.end() - 1):
+        kind = 'or' if quantifier.group('quantifier') == 'any' else 'and'
+        return kind, _comparisons(text[quantifier.end():-1], rule)
+
+    comparisons = _comparisons(text, rule)
+    if len(comparisons) > 1:
+        raise ValueError(f"Horizon range '{text}' in screening rule '{rule}' needs any(...) or all(...).")
+    return comparisons[0]
+
+
+class Rule:
+    """
+    Screening rule, e.g. 'any(1D..YTD vs. Sector < q05) | % since AEQ < -5'.
+
+    Comparisons are combined with '|' and '&' (and parentheses). Thresholds are numbers or
+    quantile references (q05, q95) which are looked up per row in the broadcast quantile tables.
+    'any(1D..YTD vs. Sector < q05)' expands to one comparison per horizon, joined by '|' ('all' joins by '&').
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tree = _parse(text, text)
+        self.predicate = self._compile(self.tree)
+
+    def __repr__(self):
+        return f"Rule('{self.text}')"
+
+    def _compile(self, node: tuple) -> Callable:
+        if node[0] == 'cmp':
+            _, column, op, value = node
+            return lambda context: context.compare(column, op, value)
+
+        children = [self._compile(child) for child in node[1]]
+        reduce = np.logical_or.reduce if node[0] == 'or' else np.logical_and.reduce
+        return lambda context: reduce([child(context) for child in children])
+
+    @property
+    def quantiles(self) -> set:
+        def collect(node):
+            if node[0] == 'cmp':
+                return {quantile_label(node[3])} if isinstance(node[3], str) else set()
+            return set().union(*(collect(child) for child in node[1]))
+
+        return collect(self.tree)
+
+    @property
+    def columns(self) -> set:
+        def collect(node):
+            if node[0] == 'cmp':
+                return {node[1]}
+            return set().union(*(collect(child) for child in node[1]))
+
+        return collect(self.tree)
+
+    def evaluate(self, frame: pd.DataFrame, thresholds: Callable[[str], pd.DataFrame]) -> pd.Series:
+        return screen(frame, {'rule': self}, thresholds)['rule']
+
+    def describe(self, quantiles: pd.DataFrame) -> str:
+        """
+        Human readable thresholds of the rule, rendered with the values of one quantile table.
+        """
+        def render(node, nested=False):
+            if node[0] == 'cmp':
+                _, column, op, value = node
+                if isinstance(value, str):
+                    value = quantiles.loc[column, quantile_label(value)]
+                return f"{column} {op} <b>{value:g}%</b>"
+
+            joiner = ", oder<br>\n   " if node[0] == 'or' else ", und<br>\n   "
+            text = joiner.join(render(child, nested=True) for child in node[1])
+            return f"({text})" if nested and node[0] == 'and' else text
+
+        return f"\n   {render(self.tree)}\n"
+
+
+class _Context:
+    def __init__(self, frame: pd.DataFrame, thresholds: Callable[[str], pd.DataFrame]):
+        self.frame = frame
+        self.thresholds = thresholds
+        self._columns = {}
+        self._quantiles = {}
+        self._comparisons = {}
+
+    def column(self, column: str) -> np.ndarray:
+        if column not in self._columns:
+            # float32 columns (see data_provider.compact) stay float32 and their thresholds are cast to match,
+            # so a threshold like 2.1 is the float32 value the column holds for 2.1
+            dtype = np.float32 if self.frame[column].dtype == np.float32 else float
+            self._columns[column] = self.frame[column].to_numpy(dtype=dtype)
+        return self._columns[column]
+
+    def threshold(self, column: str, value) -> np.ndarray:
+        dtype = self.column(column).dtype
+        if not isinstance(value, str):
+            return dtype.type(value)
+        label = quantile_label(value)
+        if label not in self._quantiles:
+            self._quantiles[label] = self.thresholds(label)
+        return self._quantiles[label][column].to_numpy(dtype=dtype)
+
+    def compare(self, column: str, op: str, value) -> np.ndarray:
+        key = (column, op, value)
+        if key not in self._comparisons:
+            self._comparisons[key] = _OPERATORS[op](self.column(column), self.threshold(column, value))
+        return self._comparisons[key]
+
+
+def screen(frame: pd.DataFrame, rules: Dict[str, Rule], thresholds: Callable[[str], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Evaluate many rules in one pass over frame. Columns, thresholds and comparisons shared by several
+    rules are computed only once.
+
+    Args:
+        frame (pd.DataFrame): Positions or universe to screen.
+        rules (Dict[str, Rule]): Rules by name.
+        thresholds (Callable): Returns the quantile thresholds broadcast onto the rows of frame for a quantile label.
+
+    Returns:
+        pd.DataFrame: One boolean column per rule, aligned with frame.
+    """
+    context = _Context(frame, thresholds)
+    return pd.DataFrame({name: np.broadcast_to(rule.predicate(context), len(frame)) for name, rule in rules.items()},
+                        index=frame.index, columns=list(rules))
+
+
+@lru_cache(maxsize=None)
+def compile_rule(text: str) -> Rule:
+    return Rule(text)
+
+
+def load_rules(path: str = 'screening_rules.json') -> Dict[str, Dict[str, Rule]]:
+    """
+    Load and compile the screening rule sets, {set name: {'positive': rule, 'negative': rule}}.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        config = json.load(file)
+
+    return {name: {kind: compile_rule(text) for kind, text in rule_set.items()} for name, rule_set in config.items()}
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import re
+import sqlite3
+from contextlib import closing
+from typing import Any, Callable, List
+
+import pandas as pd
+
+SNAPSHOT_DIR = os.path.join('.cache', 'snapshots')
+
+# Pin the position data to a stored report date, e.g. REPORT_DATE=2024-05-02, to rerun a past briefing
+REPLAY_DATE = os.environ.get('REPORT_DATE')
+
+# Path of a SQLite stand-in for the warehouse, see export_sqlite
+OPUS_SQLITE = os.environ.get('OPUS_SQLITE')
+
+
+class SnapshotStore:
+    """
+    Results of warehouse queries persisted as zstd compressed parquet files, one directory per report date
+    and one file per query fingerprint. Live runs always query the warehouse and refresh the stored file,
+    the warehouse republishes the newest reporting of a date intraday. A replay serves the stored files and
+    only queries the warehouse for results not stored yet.
+    """
+
+    def __init__(self, source: Callable[[], Any], directory: str = SNAPSHOT_DIR, replay: bool = False):
+        self.source = source
+        self.directory = directory
+        self.replay = replay
+
+    def _file(self, query: str, report_date: pd.Timestamp) -> str:
+        fingerprint = hashlib.sha256(' '.join(query.split()).encode('utf-8')).hexdigest()[:24]
+        return os.path.join(self.directory, report_date.strftime('%Y-%m-%d'), f"{fingerprint}.parquet")
+
+    def read_sql(self, query: str, report_date: pd.Timestamp) -> pd.DataFrame:
+        """
+        Result of query for report_date, from the stored snapshot when replaying.
+
+        Args:
+            query (str): SQL query, the whitespace-normalized text is the fingerprint.
+            report_date (pd.Timestamp): Report date the query belongs to.
+        """
+        path = self._file(query, report_date)
+        if self.replay and os.path.exists(path):
+            return pd.read_parquet(path)
+
+        df = self.source().read_sql(query=query)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+        return df
+
+    def report_dates(self) -> List[pd.Timestamp]:
+        """
+        Report dates with stored snapshots, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(pd.Timestamp(entry.name) for entry in os.scandir(self.directory)
+                      if entry.is_dir() and re.fullmatch(r'\d{4}-\d{2}-\d{2}', entry.name))
+
+
+class SQLiteSource:
+    """
+    Stand-in for OpusSource on a SQLite database with the reportings, accountsegments and positions tables,
+    so the warehouse queries run unchanged in tests and benchmarks.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read_sql(self, query: str) -> pd.DataFrame:
+        with closing(sqlite3.connect(self.path)) as connection:
+            df = pd.read_sql(query, connection)
+        if 'report_date' in df.columns:
+            df['report_date'] = pd.to_datetime(df['report_date'])
+        return df
+
+
+# Columns of a position snapshot (data_provider.positions_query) by warehouse table and column
+_TABLES = {
+    'accountsegments': {'accountsegment_id': 'accountsegment_id', 'account_id': 'account_id', 'segment_name': 'name',
+                        'nav': 'nav', 'base_currency': 'currency'},
+    'positions': {'position_name': 'name', 'isin': 'isin', 'bloomberg_query': 'bloomberg_query',
+                  'asset_class': 'asset_class', 'dr_class_level_1': 'dr_class_level_1',
+                  'dr_class_level_2': 'dr_class_level_2', 'average_entry_quote': 'average_entry_quote',
+                  'average_entry_xrate': 'average_entry_xrate', 'last_xrate_quantity': 'last_xrate_quantity',
+                  'last_quote': 'last_quote', 'volume': 'volume', 'eff_volume': 'eff_volume',
+                  'position_type': 'position_type', 'underlying_name': 'underlying_name',
+                  'price_per_point': 'price_per_point', 'total_exposure': 'total_exposure',
+                  'value_base_ccy': 'value_base_ccy', 'percent_nav': 'percent_nav',
+                  'profit_and_loss_percent': 'profit_and_loss_percent', 'currency': 'currency',
+                  'forex_trade_currency': 'forex_trade_currency', 'country_of_domicile': 'country_of_domicile',
+                  'gics_industry_sector': 'gics_industry_sector'},
+}
+
+
+def export_sqlite(snapshot: pd.DataFrame, path: str):
+    """
+    Write a position snapshot back into the warehouse tables of a SQLite database, appending to it,
+    e.g. export_sqlite(market_data.snapshot.frame, 'opus.sqlite') to build a stand-in with real data.
+
+    Args:
+        snapshot (pd.DataFrame): Result of data_provider.positions_query.
+        path (str): Path of the SQLite database.
+    """
+    if snapshot['report_date'].nunique() != 1:
+        raise ValueError("A position snapshot has exactly one report date.")
+
+    report_date = pd.Timestamp(snapshot['report_date'].iloc[0])
+    uuid = f"snapshot-{report_date:%Y-%m-%d}"
+
+    reportings = pd.DataFrame({'uuid': [uuid], 'report_date': [report_date.strftime('%Y-%m-%d %H:%M:%S')],
+                               'newest': [1], 'report': ['positions']})
+    segments = (snapshot[list(_TABLES['accountsegments'])].drop_duplicates('accountsegment_id')
+                .rename(columns=_TABLES['accountsegments']).assign(reporting_uuid=uuid))
+    positions = (snapshot[['accountsegment_id'] + list(_TABLES['positions'])]
+                 .rename(columns={'accountsegment_id': 'account_segment_id', **_TABLES['positions']})
+                 .assign(reporting_uuid=uuid))
+
+    # closing() closes the connection, the inner context commits the three tables together
+    with closing(sqlite3.connect(path)) as connection, connection:
+        reportings.to_sql('reportings', connection, if_exists='append', index=False)
+        segments.to_sql('accountsegments', connection, if_exists='append', index=False)
+        positions.to_sql('positions', connection, if_exists='append', index=False)
@@ -0,0 +1,265 @@
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Dict, List, Tuple
+
+import PIL
+from matplotlib.font_manager import FontProperties, findfont, fontManager
+from pandas.io.formats.style import Styler
+from PIL import Image, ImageDraw, ImageFont
+
+RENDERER_VERSION = f"pillow-{PIL.__version__}/2"
+
+# Same look as the dataframe_image stylesheet used by the browser renderer
+FONT_FAMILY = ["Helvetica Neue", "Helvetica", "Arial", "DejaVu Sans"]
+STRIPE_COLOR = "#f5f5f5"
+BOLD_ROWS = ("Sum", "Total")
+
+_STOP = re.compile(r"(#[0-9a-fA-F]{3,8}|transparent)\s+(-?[\d.]+)%")
+_COLUMN = re.compile(r"^t[hd]\.col(\d+)$")
+_PX = re.compile(r"([\d.]+)px")
+_RULE = re.compile(r"([^{}]+)\{([^}]*)\}")
+_CELL = re.compile(r"_row(\d+)_col(\d+)$")
+_HEADING = re.compile(r"_level0_col(\d+)$")
+
+
+class _TableParser(HTMLParser):
+    """
+    Cells of the HTML of Styler.to_html: the stylesheet, the column headings, the index name and
+    the body cells with their formatted text. Hidden rows, columns and index are not in the HTML.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.css = ""
+        self.headings: List[Tuple[int, str]] = []
+        self.index_name = ""
+        self.cells: Dict[Tuple[int, int], str] = {}
+        self.has_index = False
+        self._cell = None
+        self._text = []
+
+    def handle_starttag(self, tag: str, attrs: list):
+        if tag in ("style", "th", "td"):
+            self._cell = (tag, dict(attrs))
+            self._text = []
+
+    def handle_data(self, data: str):
+        if self._cell is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag: str):
+        if self._cell is None or tag != self._cell[0]:
+            return
+        attrs, text = self._cell[1], "".join(self._text).replace("\xa0", " ").strip()
+        classes = (attrs.get("class") or "").split()
+        if tag == "style":
+            self.css += text
+        elif "col_heading" in classes and _HEADING.search(attrs.get("id", "")):
+            self.headings.append((int(_HEADING.search(attrs["id"]).group(1)), text))
+        elif "index_name" in classes:
+            self.index_name = text
+            self.has_index = True
+        elif "row_heading" in classes or classes == ["blank", "level0"]:
+            self.has_index = True
+        elif tag == "td" and _CELL.search(attrs.get("id", "")):
+            row, col = _CELL.search(attrs["id"]).groups()
+            self.cells[(int(row), int(col))] = text
+        self._cell = None
+
+
+class _Glyphs:
+    """
+    Font with a cache of rasterized glyphs. Table cells share a small alphabet (digits, signs, letters),
+    so pasting cached glyph masks is much faster than letting FreeType rasterize every string.
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        self.font = font
+        ascent, descent = font.getmetrics()
+        self.middle = (ascent - descent) / 2
+        self._glyphs = {}
+
+    def _glyph(self, char: str) -> tuple:
+        if char not in self._glyphs:
+            left, top, right, bottom = self.font.getbbox(char, anchor="ls")
+            mask = Image.new("L", (max(right - left, 1), max(bottom - top, 1)), 0)
+            ImageDraw.Draw(mask).text((-left, -top), char, font=self.font, fill=255, anchor="ls")
+            self._glyphs[char] = (mask, left, top, self.font.getlength(char))
+        return self._glyphs[char]
+
+    def getlength(self, text: str) -> float:
+        return sum(self._glyph(char)[3] for char in text)
+
+    def draw(self, image: Image.Image, x_right: float, y_middle: float, text: str):
+        x = x_right - self.getlength(text)
+        baseline = y_middle + self.middle
+        for char in text:
+            mask, left, top, advance = self._glyph(char)
+            image.paste((0, 0, 0), (round(x + left), round(baseline + top)), mask)
+            x += advance
+
+
+@lru_cache(maxsize=None)
+def _fonts(fontsize: int) -> Tuple[_Glyphs, _Glyphs]:
+    """
+    Regular and bold font of the stylesheet's font family, resolved through matplotlib's font manager
+    so the renderer works on machines without any browser or system fonts.
+    """
+    available = {font.name for font in fontManager.ttflist}
+    family = next((family for family in FONT_FAMILY if family in available), "DejaVu Sans")
+    return (_Glyphs(ImageFont.truetype(findfont(FontProperties(family=family)), fontsize)),
+            _Glyphs(ImageFont.truetype(findfont(FontProperties(family=family, weight="bold")), fontsize)))
+
+
+def _bar_segments(background: str) -> List[Tuple[str, float, float]]:
+    """
+    Solid segments (color, start, end) in percent of the cell width of a Styler.bar linear-gradient.
+    """
+    stops = [(color, float(position)) for color, position in _STOP.findall(background)]
+    if not stops:
+        return []
+
+    segments = []
+    if stops[0][0] != "transparent":
+        segments.append((stops[0][0], 0.0, stops[0][1]))
+    for (color, start), (next_color, end) in zip(stops, stops[1:]):
+        if color == next_color and color != "transparent" and end > start:
+            segments.append((color, start, end))
+    if stops[-1][0] != "transparent":
+        segments.append((stops[-1][0], stops[-1][1], 100.0))
+    return segments
+
+
+def _stylesheet(css: str) -> Tuple[Dict[Tuple[int, int], List[Tuple[str, str]]], List[Tuple[str, Dict[str, str]]]]:
+    """
+    Split the stylesheet of Styler.to_html into the CSS of the body cells by (row, column) and the
+    table styles as (selector, props), with the selectors relative to the table.
+    """
+    cells, table_styles = {}, []
+    for selectors, body in _RULE.findall(css):
+        props = [tuple(part.strip() for part in prop.split(":", 1)) for prop in body.split(";") if ":" in prop]
+        for selector in (s.strip() for s in selectors.split(",")):
+            cell = _CELL.search(selector)
+            if cell and " " not in selector:
+                cells.setdefault((int(cell.group(1)), int(cell.group(2))), []).extend(props)
+            elif " " in selector:
+                table_styles.append((selector.split(" ", 1)[1].strip(), dict(props)))
+    return cells, table_styles
+
+
+def _table_layout(table_styles: List[Tuple[str, Dict[str, str]]], columns: List[int]) -> Dict:
+    """
+    Borders and minimum widths from the table styles of the Styler, the subset of CSS the reports use.
+    Column selectors refer to the positions in the DataFrame, the layout to the positions of the visible columns.
+    """
+    layout = {"left_borders": set(), "min_widths": {}, "index_min_width": 0, "last_row_border": False}
+    position = {column: i for i, column in enumerate(columns)}
+
+    for selector, props in table_styles:
+        column = _COLUMN.match(selector)
+        if column and int(column.group(1)) in position:
+            if "border-left" in props:
+                layout["left_borders"].add(position[int(column.group(1))])
+            if "min-width" in props and selector.startswith("td"):
+                layout["min_widths"][position[int(column.group(1))]] = float(_PX.match(props["min-width"]).group(1))
+        elif selector == "th.index_name" and "min-width" in props:
+            layout["index_min_width"] = float(_PX.match(props["min-width"]).group(1))
+        elif selector.startswith("tr:last-child") and "border-top" in props:
+            layout["last_row_border"] = True
+
+    return layout
+
+
+def render_table(styled: Styler, path: str, fontsize: int = 14) -> str:
+    """
+    Draw a styled DataFrame with Pillow, without a browser. Reproduces the in-cell bars, number formats,
+    column borders and the last row border of the Styler, in the layout of dataframe_image's stylesheet.
+
+    Args:
+        styled (Styler): Styled table.
+        path (str): Output path of the PNG.
+        fontsize (int): Font size in px, as passed to dataframe_image.
+
+    Returns:
+        str: path
+    """
+    # Only the public HTML output of the Styler is read, formats, hidden rows and columns apply as in the browser
+    table = _TableParser()
+    table.feed(styled.to_html())
+    ctx, table_styles = _stylesheet(table.css)
+
+    df = styled.data
+    columns = [col for col, _ in table.headings]
+    rows = sorted({row for row, _ in table.cells})
+    n_rows, n_cols = len(rows), len(columns)
+    show_index = table.has_index
+    layout = _table_layout(table_styles, columns)
+
+    header = [text for _, text in table.headings]
+    body = [[table.cells.get((row, col), "") for col in columns] for row in rows]
+    index = [str(df.index[row]) for row in rows]
+    index_name = table.index_name
+
+    regular, bold = _fonts(fontsize)
+    padding = round(0.5 * fontsize)
+    row_height = 2 * padding + round(1.2 * fontsize)
+    bold_rows = [label in BOLD_ROWS for label in index]
+
+    widths = []
+    for c in range(n_cols):
+        width = max([bold.getlength(header[c])] +
+                    [(bold if bold_rows[r] else regular).getlength(body[r][c]) for r in range(n_rows)])
+        if any(prop == "width" for r in range(n_rows) for prop, _ in ctx.get((rows[r], columns[c]), [])):
+            width = max(width, 10 * fontsize)
+        widths.append(round(max(width + 2 * padding, layout["min_widths"].get(c, 0))))
+
+    if show_index:
+        index_width = max([bold.getlength(index_name)] + [bold.getlength(label) for label in index])
+        index_width = round(max(index_width + 2 * padding, layout["index_min_width"]))
+    else:
+        index_width = 0
+
+    lefts = [index_width]
+    for width in widths[:-1]:
+        lefts.append(lefts[-1] + width)
+    total_width = index_width + sum(widths)
+    total_height = row_height * (n_rows + 1)
+
+    image = Image.new("RGB", (total_width + 1, total_height + 1), "white")
+    draw = ImageDraw.Draw(image)
+
+    def cell_text(x_right: int, row: int, text: str, font: _Glyphs):
+        font.draw(image, x_right - padding, row * row_height + row_height / 2, text)
+
+    if show_index:
+        cell_text(index_width, 0, index_name, bold)
+    for c in range(n_cols):
+        cell_text(lefts[c] + widths[c], 0, header[c], bold)
+
+    for r in range(n_rows):
+        top = (r + 1) * row_height
+        if r % 2 == 0:
+            draw.rectangle((0, top, total_width, top + row_height - 1), fill=STRIPE_COLOR)
+
+        for c in range(n_cols):
+            for prop, value in ctx.get((rows[r], columns[c]), []):
+                if prop == "background":
+                    for color, start, end in _bar_segments(value):
+                        x0 = lefts[c] + round(widths[c] * start / 100)
+                        x1 = lefts[c] + round(widths[c] * end / 100) - 1
+                        if x1 >= x0:
+                            draw.rectangle((x0, top, x1, top + row_height - 1), fill=color)
+            cell_text(lefts[c] + widths[c], r + 1, body[r][c], bold if bold_rows[r] else regular)
+
+        if show_index:
+            cell_text(index_width, r + 1, index[r], bold)
+
+    draw.line((0, row_height, total_width, row_height), fill="black")
+    if layout["last_row_border"] and n_rows:
+        draw.line((0, n_rows * row_height, total_width, n_rows * row_height), fill="black")
+    for c in layout["left_borders"]:
+        draw.line((lefts[c], 0, lefts[c], total_height), fill="black")
+
+    image.save(path, format="png", compress_level=1)
+    return path
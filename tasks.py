@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable
+
+TASK_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+
+class TaskGraph:
+    """
+    Stages of the daily run with their dependencies. A stage starts as soon as all stages it depends on
+    are finished, independent stages run concurrently. The reports mostly wait on SQL, pdflatex and the
+    render pool, so threads are enough to overlap them.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def add(self, name: str, func: Callable, after: Iterable[str] = (), inputs: Iterable[str] = ()):
+        """
+        Register a stage.
+
+        Args:
+            name (str): Unique name of the stage.
+            func (Callable): Work of the stage, called with the results of inputs as positional arguments.
+            after (Iterable[str]): Stages which have to finish first, e.g. loading data the stage reads.
+            inputs (Iterable[str]): Stages whose results are passed to func, implies after.
+        """
+        if name in self._tasks:
+            raise ValueError(f"Task '{name}' is already registered.")
+        inputs = list(inputs)
+        self._tasks[name] = (func, set(after) | set(inputs), inputs)
+
+    def _check(self):
+        for name, (_, dependencies, _) in self._tasks.items():
+            unknown = dependencies - set(self._tasks)
+            if unknown:
+                raise ValueError(f"Task '{name}' depends on unknown tasks {sorted(unknown)}.")
+
+        done, remaining = set(), dict(self._tasks)
+        while remaining:
+            ready = [name for name, (_, dependencies, _) in remaining.items() if dependencies <= done]
+            if not ready:
+                raise ValueError(f"Tasks {sorted(remaining)} have cyclic dependencies.")
+            done.update(ready)
+            for name in ready:
+                del remaining[name]
+
+    def run(self, workers: int = TASK_WORKERS) -> Dict[str, Any]:
+        """
+        Run all stages. The first failing stage stops scheduling, stages already running are awaited
+        and its exception is raised.
+
+        Returns:
+            Dict[str, Any]: Result of every stage by name.
+        """
+        self._check()
+        results = {}
+        pending = dict(self._tasks)
+        running: Dict[Future, str] = {}
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task') as executor:
+            while pending or running:
+                for name, (func, dependencies, inputs) in list(pending.items()):
+                    if dependencies <= results.keys():
+                        running[executor.submit(func, *(results[i] for i in inputs))] = name
+                        del pending[name]
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results[running.pop(future)] = future.result()
+
+        return results
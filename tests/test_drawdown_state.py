@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from drawdown_state import _fold, _initial_state, update_drawdowns
+
+
+def _prices(n: int = 120, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    values = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n, 3)), axis=0))
+    values[5:9, 1] = np.nan
+    return pd.DataFrame(values, index=pd.date_range('2024-01-01', periods=n, freq='B'), columns=['ES', 'NQ', 'VG'])
+
+
+def _assert_same(curves, state, prices):
+    full_curves, full_state = _initial_state(prices)
+    pd.testing.assert_frame_equal(curves, full_curves, check_freq=False)
+    pd.testing.assert_frame_equal(state, full_state, check_freq=False)
+
+
+def test_fold_matches_full_computation():
+    prices = _prices()
+    _, state = _initial_state(prices.iloc[:80])
+    new_curves, state = _fold(state, prices.iloc[80:])
+
+    full_curves, full_state = _initial_state(prices)
+    pd.testing.assert_frame_equal(new_curves, full_curves.iloc[80:], check_freq=False)
+    pd.testing.assert_frame_equal(state, full_state, check_freq=False)
+
+
+def test_incremental_updates_match_full_computation(tmp_path):
+    prices = _prices()
+    for rows in [60, 61, 90, 120]:
+        curves, state = update_drawdowns(prices.iloc[:rows], cache_dir=str(tmp_path))
+    _assert_same(curves, state, prices)
+    assert len(list((tmp_path / 'curves').iterdir())) == 4
+
+
+def test_revised_early_row_recomputes(tmp_path):
+    prices = _prices()
+    update_drawdowns(prices.iloc[:100], cache_dir=str(tmp_path))
+
+    revised = prices.copy()
+    revised.iloc[50, 0] = 2 * prices['ES'].max()
+    curves, state = update_drawdowns(revised, cache_dir=str(tmp_path))
+
+    _assert_same(curves, state, revised)
+    assert state.loc['ES', 'Peak Date'] == revised.index[50]
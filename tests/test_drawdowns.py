@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from utility import drawdowns
+
+
+def _prices(**columns) -> pd.DataFrame:
+    return pd.DataFrame(columns, index=pd.date_range('2024-01-01', periods=len(next(iter(columns.values())))))
+
+
+def test_rising_series_has_no_drawdown():
+    _, curves, stats = drawdowns(_prices(up=[100.0, 101, 102, 103, 104, 105]))
+
+    row = stats.loc['up']
+    assert row['Max Drawdown'] == 0
+    assert pd.isna(row['Peak Date']) and pd.isna(row['Trough Date']) and pd.isna(row['Recovery Date'])
+    assert np.isnan(row['Duration']) and np.isnan(row['Time to Recovery'])
+    assert row['Current Peak Date'] == pd.Timestamp('2024-01-06')
+    assert (curves['up'] == 0).all()
+
+
+def test_recovered_drawdown():
+    _, _, stats = drawdowns(_prices(dip=[100.0, 110, 99, 88, 100, 111, 105]))
+
+    row = stats.loc['dip']
+    assert np.isclose(row['Max Drawdown'], -0.2)
+    assert row['Peak Date'] == pd.Timestamp('2024-01-02')
+    assert row['Trough Date'] == pd.Timestamp('2024-01-04')
+    assert row['Recovery Date'] == pd.Timestamp('2024-01-06')
+    assert row['Duration'] == 4
+    assert row['Time to Recovery'] == 2
+    assert np.isclose(row['Current Drawdown'], 105 / 111 - 1)
+
+
+def test_unrecovered_drawdown_lasts_until_the_last_price():
+    _, _, stats = drawdowns(_prices(down=[100.0, 90, 80, np.nan, 85, np.nan]))
+
+    row = stats.loc['down']
+    assert np.isclose(row['Max Drawdown'], -0.2)
+    assert row['Peak Date'] == pd.Timestamp('2024-01-01')
+    assert row['Trough Date'] == pd.Timestamp('2024-01-03')
+    assert pd.isna(row['Recovery Date']) and np.isnan(row['Time to Recovery'])
+    assert row['Duration'] == 4
+    assert np.isclose(row['Current Drawdown'], -0.15)
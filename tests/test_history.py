@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import history
+
+
+def _universe(day: int, n: int = 50) -> pd.DataFrame:
+    rng = np.random.default_rng(day)
+    return pd.DataFrame({
+        'Query': [f'T{i:03d} Equity' for i in range(n)],
+        'Sector': pd.Categorical(rng.choice(['Energy', 'Materials'], n)),
+        '1D': rng.normal(size=n).astype('float32'),
+        'Last Price': rng.uniform(10, 100, n),
+    })
+
+
+@pytest.fixture
+def store(tmp_path):
+    for day, date in enumerate(pd.bdate_range('2024-01-01', periods=5)):
+        history.append('us', _universe(day), date, key='Query',
+                       types=history.column_types(['Sector'], ['1D']), directory=str(tmp_path))
+    return str(tmp_path)
+
+
+def test_read_date_range(store):
+    df = history.read('us', start='2024-01-02', end='2024-01-04', directory=store)
+
+    assert sorted(df['report_date'].unique()) == list(pd.bdate_range('2024-01-02', periods=3))
+    assert len(df) == 150
+    assert isinstance(df['Sector'].dtype, pd.CategoricalDtype)
+    assert df['1D'].dtype == np.float32
+
+
+def test_rewriting_a_date_replaces_it(store):
+    history.append('us', _universe(9, n=10), '2024-01-03', key='Query', directory=store)
+
+    df = history.read('us', start='2024-01-03', end='2024-01-03', directory=store)
+    assert len(df) == 10
+    assert history.report_dates('us', store) == list(pd.bdate_range('2024-01-01', periods=5))
+    assert history.key_dates('us', 'Query', ['T020 Equity'], store) == [pd.Timestamp('2024-01-01'),
+                                                                        pd.Timestamp('2024-01-02'),
+                                                                        pd.Timestamp('2024-01-04'),
+                                                                        pd.Timestamp('2024-01-05')]
+
+
+def test_lookup_opens_only_indexed_partitions(store):
+    history.append('us', _universe(7).assign(Query='NEW Equity').head(1), '2024-01-08', key='Query', directory=store)
+
+    assert history.key_dates('us', 'Query', ['NEW Equity'], store) == [pd.Timestamp('2024-01-08')]
+    # A partition not listed by the index is not even opened
+    os.remove(os.path.join(store, 'us', 'report_date=2024-01-01', 'part-0.parquet'))
+
+    df = history.read('us', key='Query', values=['NEW Equity'], directory=store)
+    assert df['report_date'].tolist() == [pd.Timestamp('2024-01-08')]
+
+
+def test_column_types_are_fixed_across_dates(tmp_path):
+    directory = str(tmp_path)
+    history.append('positions', pd.DataFrame({'ISIN': ['A'], 'comment': [None], 'Volume': [1]}), '2024-01-01',
+                   key='ISIN', directory=directory)
+    history.append('positions', pd.DataFrame({'ISIN': ['B'], 'comment': ['hedge'], 'Volume': ['n/a']}), '2024-01-02',
+                   key='ISIN', directory=directory)
+    history.append('positions', pd.DataFrame({'ISIN': ['C'], 'extra': [1.5]}), '2024-01-03',
+                   key='ISIN', directory=directory)
+
+    df = history.read('positions', directory=directory)
+    assert history.schema('positions', directory).field('comment').type == pa.string()
+    assert df['comment'].tolist()[:2] == [None, 'hedge']
+    assert np.isnan(df['Volume'].iloc[1])
+    assert np.isnan(df['extra'].iloc[0]) and df['extra'].iloc[2] == 1.5
+
+
+def test_bloomberg_errors_are_stored_as_null(tmp_path):
+    directory = str(tmp_path)
+    history.append('funds', pd.DataFrame({'bloomberg_query': ['A', 'B'], '1D': [0.5, '#N/A Invalid Security']}),
+                   '2024-01-01', key='bloomberg_query', directory=directory)
+
+    df = history.read('funds', directory=directory)
+    assert history.schema('funds', directory).field('1D').type == pa.float64()
+    assert df['1D'].iloc[0] == 0.5 and np.isnan(df['1D'].iloc[1])
+
+
+def test_panel(store):
+    prices = history.panel('us', 'Last Price', key='Query', values=['T000 Equity', 'T001 Equity'], directory=store)
+
+    assert prices.shape == (5, 2)
+    assert list(prices.columns) == ['T000 Equity', 'T001 Equity']
+
+
+def test_empty_history(tmp_path):
+    assert history.read('us', directory=str(tmp_path)).empty
+    assert history.report_dates('us', str(tmp_path)) == []
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rules import HORIZONS, Rule, load_rules, screen
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'screening_rules.json')
+
+COLUMNS = HORIZONS + [f'{h} vs. Sector' for h in HORIZONS] + ['% since AEQ', 'Δ 200D Mvag', 'Δ 52 Week High']
+
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.normal(0, 10, (200, len(COLUMNS))), columns=COLUMNS)
+
+
+@pytest.fixture
+def quantiles() -> dict:
+    return {'5th Quantile': pd.Series(-8.0, index=COLUMNS), '95th Quantile': pd.Series(8.0, index=COLUMNS)}
+
+
+def _thresholds(frame: pd.DataFrame, quantiles: dict):
+    return lambda label: pd.DataFrame([quantiles[label]] * len(frame), index=frame.index)
+
+
+def _any(frame: pd.DataFrame, columns, op, value) -> pd.Series:
+    return np.logical_or.reduce([op(frame[col], value[col]) for col in columns])
+
+
+def test_rule_sets_match_baseline_expressions(frame, quantiles):
+    rules = load_rules(RULES_FILE)
+    q05, q95 = quantiles['5th Quantile'], quantiles['95th Quantile']
+    vs_sector = [f'{h} vs. Sector' for h in HORIZONS]
+    lt, gt = pd.Series.__lt__, pd.Series.__gt__
+
+    expected = {
+        'positions': (_any(frame, vs_sector[:3], gt, q95),
+                      _any(frame, vs_sector, lt, q05) | (frame['% since AEQ'] < -5)),
+        'positions_trend': (_any(frame, vs_sector[:3], gt, q95),
+                            _any(frame, vs_sector, lt, q05) | (frame['% since AEQ'] < -5)
+                            | (frame['Δ 200D Mvag'] < -10) | (frame['Δ 52 Week High'] < -15)),
+        'sector': (_any(frame, vs_sector, gt, q95) & _any(frame, HORIZONS, gt, q95),
+                   _any(frame, vs_sector, lt, q05) & _any(frame, HORIZONS, lt, q05)),
+    }
+
+    for name, (positive, negative) in expected.items():
+        masks = screen(frame, rules[name], _thresholds(frame, quantiles))
+        np.testing.assert_array_equal(masks['positive'], positive)
+        np.testing.assert_array_equal(masks['negative'], negative)
+
+
+def test_and_binds_tighter_than_or():
+    frame = pd.DataFrame({'a': [1.0, 1.0, 0.0, 0.0], 'b': [1.0, 0.0, 1.0, 0.0], 'c': [0.0, 0.0, 1.0, 1.0]})
+    masks = screen(frame, {'rule': Rule('a > 0.5 | b > 0.5 & c > 0.5')}, lambda label: None)
+
+    assert masks['rule'].tolist() == [True, True, True, False]
+
+
+def test_expansion_and_columns():
+    rule = Rule('all(1D..1MO > q95) | YTD < -5')
+
+    assert rule.tree == ('or', [('and', [('cmp', '1D', '>', 'q95'), ('cmp', '5D', '>', 'q95'),
+                                         ('cmp', '1MO', '>', 'q95')]),
+                                ('cmp', 'YTD', '<', -5.0)])
+    assert rule.columns == {'1D', '5D', '1MO', 'YTD'}
+    assert rule.quantiles == {'95th Quantile'}
+
+
+@pytest.mark.parametrize('text', ['1D..YTD < q05', '1D..10Y vs. Sector < q05', '1D vs. Sector << q05'])
+def test_invalid_rules_raise(text):
+    with pytest.raises(ValueError):
+        Rule(text)
@@ -1,9 +1,11 @@
-from data_provider import third_party_products
+from data_provider import market_data
 from plot import style_third_party
+from render import collect
 from utility import group_funds
 
 
 def generate_third_party_report():
+    third_party_products = market_data.third_party_products
     esg = third_party_products[third_party_products.index.get_level_values('Name').str.contains("ESG")]
     flex = third_party_products[third_party_products.index.get_level_values('Name').str.contains("Flex")]
     strategie_select = third_party_products[third_party_products.index.get_level_values('Name').str.contains("Strategie - Select")]
@@ -20,12 +22,14 @@ def generate_third_party_report():
     premium_select_chart = style_third_party(positions=group_funds(premium_select), name="Premium-Select")
     satellites_chart = style_third_party(positions=group_funds(satellites), name="Thirds-Equity")
 
-    return {
+    satellites_chart.result()
+
+    return collect({
         'flex': flex_chart,
         'esg': esg_chart,
         'strategie-select': strategie_select_chart,
         'premium-select': premium_select_chart
-    }
+    })
 
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
 from datetime import datetime
-from typing import Dict
+from functools import lru_cache
+from typing import Dict, List
 
+import numpy as np
 import pandas as pd
 
 import os
@@ -19,64 +21,131 @@ def escape_latex(s):
             .replace('^', r'\textasciicircum{}')
 
 
-def positions_overview(data: pd.DataFrame, positions: pd.DataFrame) -> pd.DataFrame:
-    all_metrics = []
+# Names of underlyings in the positions which differ from their column in the Futures sheet
+underlying_aliases = {
+    'Deutsche Boerse AG German Stock Index DAX': 'Deutsche Boerse AG German Stock',
+}
 
-    for idx, row in positions.iterrows():
-        name, positions_name = idx
-        underlying_name = row['underlying_name']
 
-        # BUG
-        if underlying_name == 'Deutsche Boerse AG German Stock Index DAX':
-            underlying_name = 'Deutsche Boerse AG German Stock'
-
-        if underlying_name not in data.columns:
-            raise ValueError(f"Underlying data '{underlying_name}' not found in provided data dictionary.")
-
-        last_px = data[underlying_name].iloc[-1]
-
-        position_type = row['position_type']
-        avg_entry_quote = row['average_entry_quote']
-
-        if position_type == 'LONG':
-            profit_loss_percentage = (last_px - avg_entry_quote) / avg_entry_quote * 100
-        elif position_type == 'SHORT':
-            profit_loss_percentage = (avg_entry_quote - last_px) / avg_entry_quote * 100
-        else:
-            raise ValueError("Unsupported position type: " + position_type)
-
-        pnl = ((last_px - avg_entry_quote) * row['price_per_point'] * row['volume'] *
-               row['last_xrate_quantity'] * (-1 if position_type == "SHORT" else 1))
-
-        exposure = ((row['total_exposure'] * row['last_xrate_quantity']) / row['nav']) * 100
-
-        metrics = {
-            'Name': name,
-            'Position Name': positions_name,
-            'AEQ': avg_entry_quote,
-            '% since AEQ': profit_loss_percentage,
-            'Volume': row['volume'],
-            'Type': position_type,
-            'P&L': pnl,
-            'Exposure': exposure
-        }
+def positions_overview(data: pd.DataFrame, positions: pd.DataFrame, subtotals: bool = False) -> pd.DataFrame:
+    """
+    P&L and exposure of future positions against the last prices of their underlyings.
 
-        all_metrics.append(metrics)
+    Args:
+        data (pd.DataFrame): Prices, one column per underlying, the last row is used.
+        positions (pd.DataFrame): Positions indexed by (Name, Position Name).
+        subtotals (bool): Append a 'Sum' row with the P&L and exposure after the positions of every mandate.
+    """
+    underlyings = positions['underlying_name'].replace(underlying_aliases)
+    missing = sorted(set(underlyings) - set(data.columns))
+    if missing:
+        raise ValueError(f"Underlying data {missing} not found in provided data dictionary.")
+
+    position_type = positions['position_type']
+    unsupported = sorted(set(position_type) - {'LONG', 'SHORT'})
+    if unsupported:
+        raise ValueError(f"Unsupported position types: {unsupported}")
+
+    last_px = data.iloc[-1].reindex(underlyings).to_numpy(dtype=float)
+    sign = np.where(position_type == 'SHORT', -1.0, 1.0)
+    aeq = positions['average_entry_quote'].to_numpy(dtype=float)
+
+    metrics = pd.DataFrame({
+        'Name': positions.index.get_level_values(0),
+        'Position Name': positions.index.get_level_values(1),
+        'AEQ': aeq,
+        '% since AEQ': sign * (last_px - aeq) / aeq * 100,
+        'Volume': positions['volume'].to_numpy(),
+        'Type': position_type.to_numpy(),
+        'P&L': ((last_px - aeq) * positions['price_per_point'] * positions['volume'] *
+                positions['last_xrate_quantity']).to_numpy(dtype=float) * sign,
+        'Exposure': (positions['total_exposure'] * positions['last_xrate_quantity'] / positions['nav'] * 100).to_numpy(dtype=float)
+    })
 
-    metrics_df = pd.DataFrame(all_metrics)
+    if subtotals and not metrics.empty:
+        sums = metrics.groupby('Name', sort=False)[['P&L', 'Exposure']].sum().reset_index()
+        sums.insert(1, 'Position Name', 'Sum')
+        mandate = np.concatenate([pd.factorize(metrics['Name'])[0], np.arange(len(sums))])
+        is_sum = np.concatenate([np.zeros(len(metrics)), np.ones(len(sums))])
+        metrics = pd.concat([metrics, sums], ignore_index=True).iloc[np.lexsort((is_sum, mandate))].reset_index(drop=True)
 
-    return metrics_df
+    return metrics
 
 
 def drawdown(series: pd.Series):
-    previous_peaks = series.cummax()
-    drawdowns = (series - previous_peaks) / previous_peaks
+    peaks, curves, _ = drawdowns(series.to_frame())
     return pd.DataFrame({
-        "Peaks": previous_peaks,
-        "Drawdowns": drawdowns
+        "Peaks": peaks.iloc[:, 0],
+        "Drawdowns": curves.iloc[:, 0]
     })
 
 
+def drawdowns(prices: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    """
+    Drawdowns of all columns of a price matrix in one pass. Missing prices are skipped, the running peak
+    of a column only moves on its own prices.
+
+    Args:
+        prices (pd.DataFrame): Prices, one column per underlying, sorted by date.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame, pd.DataFrame): Running peaks, drawdown curves (NaN where the price is
+        missing) and per underlying: Max Drawdown, Peak Date, Trough Date, Recovery Date, Duration,
+        Time to Recovery, Current Drawdown and Current Peak Date. Durations are in calendar days,
+        recovery is NaT/NaN while the underlying has not recovered its peak, peak, trough and duration are
+        NaT/NaN for an underlying which never fell below its peak.
+    """
+    values = prices.to_numpy(dtype=float)
+    n_rows, n_cols = values.shape
+    dates = prices.index
+    cols = np.arange(n_cols)
+    rows = np.arange(n_rows)[:, None]
+    valid = ~np.isnan(values)
+    has_prices = valid.any(axis=0)
+
+    peaks = np.fmax.accumulate(values, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        curves = (values - peaks) / peaks
+
+    # Position of the last peak up to every row
+    peak_pos = np.maximum.accumulate(np.where(valid & (values >= peaks), rows, 0), axis=0)
+
+    trough_pos = np.where(has_prices, np.nanargmin(np.where(valid, curves, np.inf), axis=0), 0)
+    max_drawdown = np.where(has_prices, curves[trough_pos, cols], np.nan)
+    peak_at_trough = peak_pos[trough_pos, cols]
+
+    recovered = valid & (values >= peaks[trough_pos, cols]) & (rows > trough_pos)
+    has_recovered = recovered.any(axis=0) & (max_drawdown < 0)
+    recovery_pos = recovered.argmax(axis=0)
+
+    last_pos = n_rows - 1 - valid[::-1].argmax(axis=0)
+    end_pos = np.where(has_recovered, recovery_pos, last_pos)
+
+    def to_dates(pos, mask):
+        return pd.DatetimeIndex(np.where(mask, dates.to_numpy()[pos], np.datetime64('NaT')))
+
+    # A column which never fell below its peak has no drawdown to date
+    in_drawdown = has_prices & (max_drawdown < 0)
+    peak_dates = to_dates(peak_at_trough, in_drawdown)
+    trough_dates = to_dates(trough_pos, in_drawdown)
+    recovery_dates = to_dates(recovery_pos, has_recovered)
+
+    stats = pd.DataFrame({
+        'Max Drawdown': max_drawdown,
+        'Peak Date': peak_dates,
+        'Trough Date': trough_dates,
+        'Recovery Date': recovery_dates,
+        'Duration': (to_dates(end_pos, in_drawdown) - peak_dates).days,
+        'Time to Recovery': (recovery_dates - trough_dates).days,
+        'Current Drawdown': np.where(has_prices, curves[last_pos, cols], np.nan),
+        'Current Peak Date': to_dates(peak_pos[last_pos, cols], has_prices),
+    }, index=prices.columns)
+
+    return (pd.DataFrame(peaks, index=dates, columns=prices.columns),
+            pd.DataFrame(curves, index=dates, columns=prices.columns),
+            stats)
+
+
 def cleanup_aux_files():
     files = os.listdir("output")
     for file in files:
@@ -85,68 +154,112 @@ def cleanup_aux_files():
             os.remove(os.path.join("output", file))
 
 
-def calc_sector_diff(us: pd.DataFrame, eu: pd.DataFrame) -> pd.DataFrame:
-    common_columns = us.columns.intersection(eu.columns)
-    common_index = us.index.intersection(eu.index)
+def sector_spreads(regions: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Pairwise spreads of sector returns between regions, region A - region B for all pairs at once,
+    computed as one broadcast over a regions x sectors x horizons array.
 
-    diff = pd.DataFrame(index=common_index, columns=common_columns)
+    Args:
+        regions (Dict[str, pd.DataFrame]): Sector returns by region, sectors as index and horizons as columns.
+
+    Returns:
+        pd.DataFrame: Spreads indexed by (Region, vs. Region, sector) for the sectors and horizons all regions have,
+        in the order of the first region. Select a pair with .loc[('EU', 'US')].
+    """
+    names = list(regions)
+    frames = list(regions.values())
+    index, columns = frames[0].index, frames[0].columns
+    for frame in frames[1:]:
+        index, columns = index.intersection(frame.index), columns.intersection(frame.columns)
 
-    for col in common_columns:
-        for idx in common_index:
-            diff.at[idx, col] = eu.at[idx, col] - us.at[idx, col]
+    values = np.stack([frame.loc[index, columns].to_numpy(dtype=float) for frame in frames])
+    spreads = values[:, None] - values[None, :]
 
-    last_row_diff = eu.loc[eu.index[-1]] - us.loc[us.index[-1]]
-    name = f"{eu.index[-1]} - {us.index[-1]}"
-    diff = pd.concat([diff, pd.DataFrame([last_row_diff.values],
-                                         columns=common_columns,
-                                         index=[name])])
+    # Levels in the order given keep the index lexsorted for .loc
+    n, m = len(names), len(index)
+    codes = [np.repeat(np.arange(n), n * m), np.tile(np.repeat(np.arange(n), m), n), np.tile(np.arange(m), n * n)]
+    return pd.DataFrame(spreads.reshape(-1, len(columns)), columns=columns,
+                        index=pd.MultiIndex(levels=[names, names, index], codes=codes,
+                                            names=['Region', 'vs. Region', index.name or 'GICS']))
+
+
+def calc_sector_diff(us: pd.DataFrame, eu: pd.DataFrame) -> pd.DataFrame:
+    diff = sector_spreads({'US': us, 'EU': eu}).loc[('EU', 'US')]
+
+    last_row_diff = eu.iloc[-1].reindex(diff.columns).to_numpy(dtype=float) - us.iloc[-1].reindex(diff.columns).to_numpy(dtype=float)
+    diff.loc[f"{eu.index[-1]} - {us.index[-1]}"] = last_row_diff
     diff.index.name = 'GICS'
     return diff
 
 
-def calc_universe_rel_performance_vs_sector(universe: pd.DataFrame, sector: pd.DataFrame) -> pd.DataFrame:
-    sector_mapping = sector.index.to_series().str.extract(r'(\d+)\s*(.*)')
+time_frames = ['1D', '5D', '1MO', 'YTD']
+
+
+@lru_cache(maxsize=None)
+def _sector_mapping(sectors: tuple) -> Dict[str, str]:
+    sector_mapping = pd.Series(sectors).str.extract(r'(\d+)\s*(.*)')
     sector_mapping.columns = ['Sector_Number', 'Cleaned_Sector']
-    sector_mapping['Full_Sector'] = sector.index
-    sector_mapping_dict = sector_mapping.set_index('Cleaned_Sector')['Full_Sector'].to_dict()
+    sector_mapping['Full_Sector'] = sectors
+    return sector_mapping.set_index('Cleaned_Sector')['Full_Sector'].to_dict()
 
-    universe['Sector'] = universe['Sector'].map(sector_mapping_dict)
 
-    def calculate_difference(row, sector):
-        sector_row = sector.loc[row['Sector']]
+def sector_mapping(sector: pd.DataFrame) -> Dict[str, str]:
+    """
+    Map plain GICS sector names ('Energy') to the numbered index of the sector table ('10 Energy').
+    """
+    return _sector_mapping(tuple(sector.index))
 
-        for time_frame in ['1D', '5D', '1MO', 'YTD']:
-            row[f'{time_frame} vs. Sector'] = row[time_frame] - sector_row[time_frame]
 
-        return row
+def calc_universe_rel_performance_vs_sector(universe: pd.DataFrame, sector: pd.DataFrame) -> pd.DataFrame:
+    universe = universe.copy()
+    universe['Sector'] = universe['Sector'].map(sector_mapping(sector))
+
+    benchmark = sector[time_frames].reindex(universe['Sector']).to_numpy(dtype=float)
+    relative = universe[time_frames].to_numpy(dtype=float) - benchmark
 
-    universe = universe.apply(
-        lambda row: calculate_difference(row, sector), axis=1
-    )
+    for i, time_frame in enumerate(time_frames):
+        universe[f'{time_frame} vs. Sector'] = relative[:, i]
 
     return universe
 
 
 def calc_position_rel_performance_vs_sector(positions: pd.DataFrame, us: pd.DataFrame, eu: pd.DataFrame) -> pd.DataFrame:
-    def calculate_difference(row, benchmark_df):
-        if row['Sector'] and row['Region'] in ['NORTH AMERICA', 'EU']:
-            benchmark_row = benchmark_df.loc[row['Sector']]
+    positions = positions.copy()
 
-            for time_frame in ['1D', '5D', '1MO', 'YTD']:
-                row[f'{time_frame} vs. Sector'] = row[time_frame] - benchmark_row[time_frame]
-        else:
-            for time_frame in ['1D', '5D', '1MO', 'YTD']:
-                row[f'{time_frame} vs. Sector'] = 0
+    is_eu = (positions['Region'] == 'EU').to_numpy()
+    has_benchmark = ((positions['Sector'].notna() & (positions['Sector'] != '')) &
+                     positions['Region'].isin(['NORTH AMERICA', 'EU'])).to_numpy()
 
-        return row
+    benchmark = np.where(is_eu[:, None],
+                         eu[time_frames].reindex(positions['Sector']).to_numpy(dtype=float),
+                         us[time_frames].reindex(positions['Sector']).to_numpy(dtype=float))
+    relative = np.where(has_benchmark[:, None], positions[time_frames].to_numpy(dtype=float) - benchmark, 0)
 
-    positions = positions.apply(
-        lambda row: calculate_difference(row, eu if row['Region'] == 'EU' else us), axis=1
-    )
+    for i, time_frame in enumerate(time_frames):
+        positions[f'{time_frame} vs. Sector'] = relative[:, i]
 
     return positions
 
 
+def cap_weighted(df: pd.DataFrame, by, columns: List[str], weight: str = 'CUR_MKT_CAP') -> pd.DataFrame:
+    """
+    Market cap weighted averages of many columns for all groups in one pass, e.g. sector returns
+    from the constituents of a universe.
+
+    Args:
+        df (pd.DataFrame): Constituents.
+        by: Column(s) or keys to group by, e.g. 'GICS', or a basket per constituent.
+        columns (List[str]): Columns to average, e.g. returns over several horizons.
+        weight (str): Column with the market cap.
+
+    Returns:
+        pd.DataFrame: One row per group, one column per column.
+    """
+    keys = df[by] if isinstance(by, str) else by
+    weights = df[weight] / df[weight].groupby(keys).transform('sum')
+    return df[columns].mul(weights, axis=0).groupby(keys).sum()
+
+
 def group_funds(positions: pd.DataFrame) -> pd.DataFrame:
     positions.reset_index(inplace=True)
 
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+WORKBOOK = 'data.xlsx'
+CACHE_DIR = os.path.join('.cache', 'workbook')
+
+# read_excel arguments per sheet, everything the reports consume from data.xlsx
+SHEETS = {
+    'Futures': dict(header=0, skiprows=[1, 2], index_col=0),
+    'S&P 500': dict(header=0),
+    'STOXX Europe 600': dict(header=0),
+    'Regions': dict(header=0, index_col=1),
+    'Stocks': dict(header=0),
+    'Funds': dict(header=0),
+    'US Sector': dict(header=0, index_col=0),
+    'EU Sector': dict(header=0),
+    'SXXP Index': dict(header=0, index_col=0),
+    'SPX Index': dict(header=0, index_col=0),
+    'Sector': dict(header=4, index_col=0),
+}
+
+_frames: Dict[tuple, pd.DataFrame] = {}
+_validated: Dict[str, tuple] = {}
+_lock = threading.Lock()
+
+
+def _fingerprint(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _sheet_file(sheet_name: str) -> str:
+    return os.path.join(CACHE_DIR, f"{sheet_name.replace(' ', '_').replace('&', '')}.parquet")
+
+
+def _manifest_file() -> str:
+    return os.path.join(CACHE_DIR, 'manifest.json')
+
+
+def _read_manifest() -> Dict:
+    try:
+        with open(_manifest_file(), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(manifest: Dict):
+    tmp = _manifest_file() + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp, _manifest_file())
+
+
+def _split_errors(df: pd.DataFrame) -> (pd.DataFrame, Dict[str, Dict[str, str]]):
+    """
+    Coerce numeric columns polluted by Bloomberg error strings ('#N/A Invalid Security', ...) to float,
+    so every sheet has a proper columnar schema. The error strings are returned by column and row position
+    and put back by _restore_errors, the reports tell them apart from values which are just missing.
+    """
+    errors = {}
+    for position in np.flatnonzero((df.dtypes == object).to_numpy()):
+        values = df.iloc[:, position]
+        strings = values.map(lambda v: isinstance(v, str)).to_numpy()
+        if strings.any() and values[strings].str.startswith('#N/A').all():
+            errors[str(position)] = {str(row): values.iloc[row] for row in np.flatnonzero(strings)}
+            df.isetitem(position, pd.to_numeric(values, errors='coerce'))
+    return df, errors
+
+
+def _restore_errors(df: pd.DataFrame, errors: Dict[str, Dict[str, str]]) -> pd.DataFrame:
+    for position, cells in errors.items():
+        values = df.iloc[:, int(position)].astype(object)
+        values.iloc[[int(row) for row in cells]] = list(cells.values())
+        df.isetitem(int(position), values)
+    return df
+
+
+def build_cache(path: str = WORKBOOK) -> Dict[str, pd.DataFrame]:
+    """
+    Parse every registered sheet of the workbook in a single pass and write them to the parquet cache.
+
+    Args:
+        path (str): Path to the Excel workbook.
+    """
+    with pd.ExcelFile(path) as xls:
+        frames = {name: xls.parse(name, **kwargs) for name, kwargs in SHEETS.items()}
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    errors = {}
+    for name, df in frames.items():
+        df, errors[name] = _split_errors(df.copy())
+        df.to_parquet(_sheet_file(name))
+
+    stat = os.stat(path)
+    _write_manifest({
+        'workbook': os.path.abspath(path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': _fingerprint(path),
+        'sheets': {name: os.path.basename(_sheet_file(name)) for name in frames},
+        'errors': errors
+    })
+    return frames
+
+
+def _cache_key(path: str) -> Optional[str]:
+    """
+    Return the sha256 of the cached workbook if the cache is still valid for it, otherwise None.
+    The hash is only recomputed if mtime or size changed.
+    """
+    stat = os.stat(path)
+    manifest = _read_manifest()
+
+    if (manifest.get('workbook') != os.path.abspath(path) or set(manifest.get('sheets', {})) != set(SHEETS)
+            or set(manifest.get('errors', {})) != set(SHEETS)):
+        return None
+    if manifest['mtime_ns'] == stat.st_mtime_ns and manifest['size'] == stat.st_size:
+        return manifest['sha256']
+    if _fingerprint(path) == manifest['sha256']:
+        manifest.update({'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size})
+        _write_manifest(manifest)
+        return manifest['sha256']
+    return None
+
+
+def read_sheet(sheet_name: str, path: str = WORKBOOK) -> pd.DataFrame:
+    """
+    Read a sheet of the workbook, from the memory-mapped parquet cache whenever the workbook is unchanged.
+
+    Args:
+        sheet_name (str): Name of the sheet, must be registered in SHEETS.
+        path (str): Path to the Excel workbook.
+    """
+    if sheet_name not in SHEETS:
+        raise ValueError(f"Sheet '{sheet_name}' is not registered in workbook.SHEETS.")
+
+    stat = os.stat(path)
+    state = (stat.st_mtime_ns, stat.st_size)
+
+    # Report stages read sheets concurrently, the workbook must only be parsed once
+    with _lock:
+        if _validated.get(path, (None,))[:2] != state:
+            key = _cache_key(path)
+            if key is None:
+                frames = build_cache(path)
+                key = _read_manifest()['sha256']
+                _frames.update({(key, name): df for name, df in frames.items()})
+            _validated[path] = state + (key,)
+
+        key = _validated[path][2]
+        if (key, sheet_name) not in _frames:
+            df = pd.read_parquet(_sheet_file(sheet_name), memory_map=True)
+            _frames[(key, sheet_name)] = _restore_errors(df, _read_manifest()['errors'][sheet_name])
+
+    return _frames[(key, sheet_name)].copy()